@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+from typing import Iterable
+
+import asyncpg
+import psycopg2
+from dotenv import load_dotenv
+
+from utils import async_measure, log_throughput, record_latency
+from db_utils import create_table
+from copy_utils import COPY_COLUMNS
+from my_types import Row
+from data_utils import get_data_as_tuples_chunked
+from constants import DATA_JSONL_PATH, TABLE_NAME
+
+
+def create_apg_pool(size: int) -> asyncpg.Pool:
+    return asyncpg.create_pool(
+        host="localhost",
+        port=os.environ["PG_PORT"],
+        database="pgvector-test",
+        user=os.environ["PG_USER"],
+        password=os.environ["PG_PASSWORD"],
+        min_size=size,
+        max_size=size,
+    )
+
+
+@record_latency
+async def copy_records_into_pool(apg_pool: asyncpg.Pool, chunk: list[tuple[Row]]):
+    async with apg_pool.acquire() as apg_conn:
+        await apg_conn.copy_records_to_table(
+            TABLE_NAME, records=chunk, columns=COPY_COLUMNS
+        )
+    return len(chunk)
+
+
+def asyncpg_copy_from(
+    glob_conn,
+    chunk_size: int,
+    pool_size: int = 10,
+    max_in_flight: int = -1,
+    limit: int = -1,
+    create: bool = True,
+):
+    """
+    params:
+    connection: PG connector
+    chunk_size: int, number of rows sent to pg in single COPY
+    pool_size: int, number of asyncpg connections
+    max_in_flight: int, max chunks read but not yet copied, defaults to 2 * pool_size
+    limit: int, total number of rows to be insterted to pg
+    create: bool, (re)create the table, False loads into the existing one
+    """
+    if create:
+        create_table(glob_conn, TABLE_NAME)
+    if max_in_flight < 0:
+        max_in_flight = 2 * pool_size
+    data = get_data_as_tuples_chunked(
+        DATA_JSONL_PATH, limit=limit, chunk_size=chunk_size
+    )
+    s = time.perf_counter()
+    rows = asyncio.run(
+        run_copy_records_loop(data, pool_size, max_in_flight, chunk_size=chunk_size)
+    )
+    log_throughput("asyncpg_copy_from", chunk_size, rows, time.perf_counter() - s)
+
+
+@async_measure
+async def run_copy_records_loop(
+    data: Iterable[list[tuple[Row]]],
+    pool_size: int,
+    max_in_flight: int,
+    chunk_size: int,
+) -> int:
+    """
+    params:
+    data: Iterable[list[tuple[Row]]], stream of (author, text, likes, video_id) chunks
+    pool_size: int, number of asyncpg connections
+    max_in_flight: int, max chunks read but not yet copied
+    chunk_size: int, number of rows sent to pg in single COPY
+    """
+    rows = 0
+    async with create_apg_pool(pool_size) as apg_pool:
+        tasks = set()
+        for chunk in data:
+            if len(tasks) >= max_in_flight:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                rows += sum(task.result() for task in done)
+            tasks.add(asyncio.create_task(copy_records_into_pool(apg_pool, chunk)))
+        if tasks:
+            rows += sum(await asyncio.gather(*tasks))
+    return rows
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    glob_conn = psycopg2.connect(
+        host="localhost",
+        port=os.environ["PG_PORT"],
+        database="pgvector-test",
+        user=os.environ["PG_USER"],
+        password=os.environ["PG_PASSWORD"],
+    )
+    glob_conn.autocommit = True
+
+    if not glob_conn.closed:
+        print("Connected to postgres\n")
+
+    asyncpg_copy_from(glob_conn, chunk_size=1000, pool_size=10)
+
+    glob_conn.close()
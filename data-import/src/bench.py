@@ -0,0 +1,221 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import product
+
+from dotenv import load_dotenv
+
+from utils import pop_latencies, start_latency_recording
+from db_utils import create_connection
+from seq_import import seq_copy_from, seq_insert_into, seq_insert_into_prepared
+from parallel_import import async_insert_into, parallel_copy_from, pipeline_copy_from
+from asyncpg_import import asyncpg_copy_from
+from pipeline_import import seq_insert_into_pipeline
+from constants import TABLE_NAME
+
+
+def bench_insert(conn, chunk_size: int, limit: int, workers: int):
+    seq_insert_into(conn, chunk_size=chunk_size, limit=limit)
+
+
+def bench_insert_prepared(conn, chunk_size: int, limit: int, workers: int):
+    seq_insert_into_prepared(conn, chunk_size=chunk_size, limit=limit)
+
+
+def bench_insert_pipeline(conn, chunk_size: int, limit: int, workers: int):
+    seq_insert_into_pipeline(conn, chunk_size=chunk_size, limit=limit)
+
+
+def bench_copy(conn, chunk_size: int, limit: int, workers: int):
+    seq_copy_from(conn, chunk_size=chunk_size, limit=limit)
+
+
+def bench_copy_binary(conn, chunk_size: int, limit: int, workers: int):
+    seq_copy_from(conn, chunk_size=chunk_size, limit=limit, binary=True)
+
+
+def bench_async_insert(conn, chunk_size: int, limit: int, workers: int):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        async_insert_into(conn, executor, chunk_size=chunk_size, limit=limit)
+
+
+def bench_parallel_copy(conn, chunk_size: int, limit: int, workers: int):
+    parallel_copy_from(conn, chunk_size=chunk_size, num_workers=workers, limit=limit)
+
+
+def bench_pipeline_copy(conn, chunk_size: int, limit: int, workers: int):
+    pipeline_copy_from(conn, chunk_size=chunk_size, num_writers=workers, limit=limit)
+
+
+def bench_asyncpg_copy(conn, chunk_size: int, limit: int, workers: int):
+    asyncpg_copy_from(conn, chunk_size=chunk_size, pool_size=workers, limit=limit)
+
+
+# every strategy recreates the table itself, so each run starts from empty table
+STRATEGIES = {
+    "insert": bench_insert,
+    "insert_prepared": bench_insert_prepared,
+    "insert_pipeline": bench_insert_pipeline,
+    "copy": bench_copy,
+    "copy_binary": bench_copy_binary,
+    "async_insert": bench_async_insert,
+    "parallel_copy": bench_parallel_copy,
+    "pipeline_copy": bench_pipeline_copy,
+    "asyncpg_copy": bench_asyncpg_copy,
+}
+# strategies which use the worker count, the others run only once per worker sweep
+PARALLEL_STRATEGIES = {
+    "async_insert",
+    "parallel_copy",
+    "pipeline_copy",
+    "asyncpg_copy",
+}
+
+RESULT_FIELDS = [
+    "strategy",
+    "chunk_size",
+    "workers",
+    "limit",
+    "trial",
+    "rows",
+    "seconds",
+    "rows_per_s",
+    "chunks",
+    "p50_chunk_ms",
+    "p95_chunk_ms",
+    "peak_rss_mb",
+    "peak_children_rss_mb",
+]
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_trial(strategy: str, chunk_size: int, limit: int, workers: int) -> dict:
+    """
+    Runs single strategy in a fresh process, so peak RSS belongs to this run only
+    """
+    load_dotenv()
+    conn = create_connection()
+    conn.autocommit = True
+    try:
+        start_latency_recording()
+        start = time.perf_counter()
+        STRATEGIES[strategy](conn, chunk_size, limit, workers)
+        seconds = time.perf_counter() - start
+        latencies = pop_latencies()
+
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {TABLE_NAME}")
+            rows = cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+    p50, p95 = percentile(latencies, 0.5), percentile(latencies, 0.95)
+    # ru_maxrss is in kB on linux
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_s": rows / seconds if seconds else None,
+        "chunks": len(latencies),
+        "p50_chunk_ms": None if p50 is None else 1000 * p50,
+        "p95_chunk_ms": None if p95 is None else 1000 * p95,
+        "peak_rss_mb": self_usage.ru_maxrss / 1024,
+        "peak_children_rss_mb": children_usage.ru_maxrss / 1024,
+    }
+
+
+def run_matrix(
+    strategies: list[str],
+    chunk_sizes: list[int],
+    workers: list[int],
+    limits: list[int],
+    warmup: int,
+    trials: int,
+) -> list[dict]:
+    mp_context = multiprocessing.get_context("spawn")
+    results = []
+    for strategy, chunk_size, num_workers, limit in product(
+        strategies, chunk_sizes, workers, limits
+    ):
+        if strategy not in PARALLEL_STRATEGIES and num_workers != workers[0]:
+            continue
+        for trial in range(-warmup, trials):
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as executor:
+                result = executor.submit(
+                    run_trial, strategy, chunk_size, limit, num_workers
+                ).result()
+            if trial < 0:
+                continue
+            result = {
+                "strategy": strategy,
+                "chunk_size": chunk_size,
+                "workers": num_workers,
+                "limit": limit,
+                "trial": trial,
+                **result,
+            }
+            print(json.dumps(result))
+            results.append(result)
+    return results
+
+
+def write_results(results: list[dict], output: str):
+    with open(f"{output}.json", "w") as f:
+        json.dump(results, f, indent=2)
+    with open(f"{output}.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def parse_int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks import strategies over chunk size x workers x limit"
+    )
+    parser.add_argument(
+        "--strategies",
+        type=lambda value: value.split(","),
+        default=list(STRATEGIES),
+        help=f"comma separated subset of: {', '.join(STRATEGIES)}",
+    )
+    parser.add_argument("--chunk-sizes", type=parse_int_list, default=[1000])
+    parser.add_argument("--workers", type=parse_int_list, default=[4])
+    parser.add_argument("--limits", type=parse_int_list, default=[-1])
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument(
+        "--output",
+        default=os.path.join("bulk-import", "bench"),
+        help="results path without extension, .json and .csv are written",
+    )
+    args = parser.parse_args()
+
+    unknown = set(args.strategies) - set(STRATEGIES)
+    if unknown:
+        parser.error(f"unknown strategies: {', '.join(sorted(unknown))}")
+
+    results = run_matrix(
+        args.strategies,
+        args.chunk_sizes,
+        args.workers,
+        args.limits,
+        args.warmup,
+        args.trials,
+    )
+    write_results(results, args.output)
@@ -1,3 +1,4 @@
 TABLE_NAME = "youtube_comments"
 DATA_JSONL_PATH = "data/comments/all_data/all_comments.jsonl"
 TIME_LOG_PATH = "bulk-import/measured.txt"
+PSQL_CONFIG_PATH = "data-import/psql-config"
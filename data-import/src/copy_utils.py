@@ -0,0 +1,163 @@
+import io
+import json
+import struct
+from functools import partial
+from typing import Callable, Iterable
+
+from my_types import Row
+
+# PGCOPY wire format: signature, flags field, header extension length,
+# kept byte for byte equal to update_with_embed/src/utils/vector_codec.py,
+# the two source trees run as separate scripts and cannot import each other
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+NULL_FIELD = struct.pack("!i", -1)
+
+EMBED_DIM = 768
+
+# youtube_comments columns in the order the JSONL rows come in
+COPY_COLUMNS = ("author", "text", "likes", "video_id")
+COPY_FIELD_TYPES = ("text", "text", "int4", "bpchar")
+COPY_COLUMNS_WITH_EMBED = COPY_COLUMNS + ("embed",)
+COPY_FIELD_TYPES_WITH_EMBED = COPY_FIELD_TYPES + ("vector",)
+
+
+def encode_text(value) -> bytes:
+    # binary recv of text/bpchar is the raw string in client encoding,
+    # PG rejects NUL in text, so it is stripped as in the text format path
+    return str(value).replace("\0", "").encode("utf-8")
+
+
+def encode_int4(value) -> bytes:
+    return struct.pack("!i", int(value))
+
+
+def encode_vector(value) -> bytes:
+    """
+    pgvector binary recv: int16 dim, int16 unused, dim x float4 (big endian),
+    same encoding as update_with_embed/src/utils/vector_codec.encode_vector
+    """
+    if hasattr(value, "astype"):
+        # numpy array, convert without going through python floats
+        data = value.astype(">f4", copy=False).tobytes()
+        return struct.pack("!hh", len(value), 0) + data
+    dim = len(value)
+    return struct.pack(f"!hh{dim}f", dim, 0, *value)
+
+
+FIELD_ENCODERS = {
+    "text": encode_text,
+    "bpchar": encode_text,
+    "int4": encode_int4,
+    "vector": encode_vector,
+}
+
+
+def write_binary_row(buffer: bytearray, row: tuple[Row], field_types: tuple[str]):
+    buffer += struct.pack("!h", len(field_types))
+    for value, field_type in zip(row, field_types):
+        if value is None:
+            buffer += NULL_FIELD
+            continue
+        data = FIELD_ENCODERS[field_type](value)
+        buffer += struct.pack("!i", len(data))
+        buffer += data
+
+
+# COPY text format: backslash must be escaped before the escapes it introduces
+TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def escape_text_row(row: tuple[Row]) -> str:
+    return "\t".join(
+        "\\N" if value is None else str(value).replace("\0", "").translate(TEXT_ESCAPES)
+        for value in row
+    )
+
+
+def write_text_row(buffer: bytearray, row: tuple[Row]):
+    buffer += escape_text_row(row).encode("utf-8")
+    buffer += b"\n"
+
+
+class CopyStream(io.RawIOBase):
+    """
+    File-like COPY source, rows are encoded on demand as psycopg2 pulls data
+    with read(n). All rows share one bytearray, consumed bytes are dropped
+    from its front, so memory is bounded by the read size plus one row.
+    """
+
+    def __init__(
+        self,
+        rows: Iterable[tuple[Row]],
+        write_row: Callable[[bytearray, tuple[Row]], None] = write_text_row,
+        header: bytes = b"",
+        trailer: bytes = b"",
+    ):
+        self._rows = iter(rows)
+        self._write_row = write_row
+        self._buffer = bytearray(header)
+        self._trailer = trailer
+        self._exhausted = False
+
+    def readable(self):
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._exhausted and (size < 0 or len(self._buffer) < size):
+            try:
+                self._write_row(self._buffer, next(self._rows))
+            except StopIteration:
+                self._buffer += self._trailer
+                self._exhausted = True
+        if size < 0 or size >= len(self._buffer):
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+
+def binary_copy_stream(
+    rows: Iterable[tuple[Row]], field_types: tuple[str] = COPY_FIELD_TYPES
+) -> CopyStream:
+    return CopyStream(
+        rows,
+        partial(write_binary_row, field_types=field_types),
+        header=PGCOPY_HEADER,
+        trailer=PGCOPY_TRAILER,
+    )
+
+
+def encode_binary_copy(
+    rows: Iterable[tuple[Row]], field_types: tuple[str] = COPY_FIELD_TYPES
+) -> io.BytesIO:
+    """
+    params:
+    rows: Iterable[tuple[Row]], (author, text, likes, video_id[, embed]) tuples
+    field_types: tuple[str], PG type of each tuple item, keys of FIELD_ENCODERS
+
+    returns complete COPY ... (FORMAT binary) payload
+    """
+    buffer = bytearray(PGCOPY_HEADER)
+    for row in rows:
+        write_binary_row(buffer, row, field_types)
+    buffer += PGCOPY_TRAILER
+    return io.BytesIO(buffer)
+
+
+def encode_json_lines(
+    lines: list[bytes], field_types: tuple[str] = COPY_FIELD_TYPES
+) -> tuple[int, bytes]:
+    """
+    Parses raw JSONL lines and encodes them as binary COPY payload,
+    module level so it can run in a process pool
+
+    returns (number of rows, payload)
+    """
+    rows = (tuple(json.loads(line).values()) for line in lines)
+    return len(lines), encode_binary_copy(rows, field_types).getvalue()
@@ -1,35 +1,231 @@
-import jsonlines
+import gzip
 import io
+import jsonlines
+import mmap
+import os
+import queue
+import threading
+from itertools import islice
+from typing import Iterable, Iterator
 from my_types import Row
+from copy_utils import escape_text_row
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+
+
+class PrefetchReader(io.RawIOBase):
+    """
+    Reads `source` block by block in a background thread, so decompression
+    (zlib and zstd release the GIL) runs in parallel with the consumer.
+    At most `max_blocks` blocks are buffered ahead.
+    """
+
+    def __init__(self, source, block_size: int = 1 << 20, max_blocks: int = 8):
+        self._source = source
+        self._block_size = block_size
+        self._blocks = queue.Queue(maxsize=max_blocks)
+        self._stop = threading.Event()
+        self._pending = memoryview(b"")
+        self._eof = False
+        self._error = None
+        self._thread = threading.Thread(target=self._prefetch, daemon=True)
+        self._thread.start()
+
+    def _prefetch(self):
+        try:
+            while not self._stop.is_set():
+                block = self._source.read(self._block_size)
+                self._put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self._error = e
+            self._put(b"")
+
+    def _put(self, block: bytes):
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(block, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._pending:
+            if self._eof:
+                return 0
+            block = self._blocks.get()
+            if not block:
+                self._eof = True
+                if self._error is not None:
+                    raise self._error
+                return 0
+            self._pending = memoryview(block)
+        size = min(len(b), len(self._pending))
+        b[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._source.close()
+        super().close()
+
+
+def is_compressed(path) -> bool:
+    return str(path).endswith(COMPRESSED_SUFFIXES)
+
+
+def open_decompressed(path):
+    """
+    returns binary stream of decompressed .jsonl.gz / .jsonl.zst content
+    """
+    if str(path).endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("reading .zst input needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+    return gzip.open(path, "rb")
+
+
+def open_jsonl(path, binary: bool = False):
+    """
+    Opens plain or compressed JSONL, compressed input is decompressed
+    on the fly by PrefetchReader
+    """
+    if not is_compressed(path):
+        return open(path, "rb" if binary else "r")
+    stream = io.BufferedReader(PrefetchReader(open_decompressed(path)))
+    return stream if binary else io.TextIOWrapper(stream, encoding="utf-8")
+
+
+def iter_rows(path, limit: int = -1) -> Iterator[Row]:
+    """
+    Lazily yields rows from a JSONL file (.gz/.zst allowed), stops reading
+    once `limit` rows were read (limit < 0 means the whole file)
+    """
+    with open_jsonl(path) as fp:
+        rows = jsonlines.Reader(fp).iter(type=dict)
+        if limit >= 0:
+            rows = islice(rows, limit)
+        yield from rows
+
+
+def iter_raw_lines(path, limit: int = -1) -> Iterator[bytes]:
+    """
+    Lazily yields undecoded JSONL lines, JSON parsing is left to the consumer
+    """
+    with open_jsonl(path, binary=True) as fp:
+        lines = (line for line in fp if line.strip())
+        if limit >= 0:
+            lines = islice(lines, limit)
+        yield from lines
+
+
+def rows_end_offset(mm: mmap.mmap, limit: int) -> int:
+    """
+    returns byte offset just after the first `limit` non empty lines
+    """
+    pos = 0
+    rows = 0
+    while rows < limit and pos < len(mm):
+        newline = mm.find(b"\n", pos)
+        stop = len(mm) if newline < 0 else newline + 1
+        if mm[pos:stop].strip():
+            rows += 1
+        pos = stop
+    return pos
+
+
+def split_byte_ranges(
+    path, num_ranges: int, limit: int = -1
+) -> list[tuple[int, int]]:
+    """
+    Splits file into at most `num_ranges` (start, end) byte ranges,
+    every range starts at the beginning of a line and ends after a newline,
+    limit >= 0 covers only the first `limit` rows
+    """
+    if is_compressed(path):
+        raise ValueError(f"{path}: byte range split needs uncompressed input")
+    with open(path, "rb") as fp:
+        size = os.fstat(fp.fileno()).st_size
+        if size == 0:
+            return []
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if limit >= 0:
+                size = rows_end_offset(mm, limit)
+                if size == 0:
+                    return []
+            bounds = [0]
+            for i in range(1, num_ranges):
+                pos = max(size * i // num_ranges, bounds[-1] + 1)
+                newline = mm.find(b"\n", pos - 1)
+                start = size if newline < 0 else newline + 1
+                if start >= size:
+                    break
+                if start > bounds[-1]:
+                    bounds.append(start)
+            bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_lines_in_range(path, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = start
+            while pos < end:
+                newline = mm.find(b"\n", pos, end)
+                stop = end if newline < 0 else newline + 1
+                line = mm[pos:stop]
+                if line.strip():
+                    yield line
+                pos = stop
+
+
+def iter_rows_in_range(path, start: int, end: int) -> Iterator[Row]:
+    """
+    Lazily yields rows of a (start, end) range from split_byte_ranges
+    """
+    yield from jsonlines.Reader(iter_lines_in_range(path, start, end)).iter(type=dict)
+
+
+def chunked(items: Iterable, chunk_size: int) -> Iterator[list]:
+    """
+    Groups items into lists of `chunk_size`, chunk_size < 0 means single chunk
+    """
+    items = iter(items)
+    if chunk_size < 0:
+        chunk = list(items)
+        if chunk:
+            yield chunk
+        return
+    while chunk := list(islice(items, chunk_size)):
+        yield chunk
 
 
 def get_data_as_tuples_chunked(
     path, limit: int = -1, chunk_size: int = 1
-) -> list[tuple[Row]]:
-    with open(path, "r") as fp:
-        rows = list(jsonlines.Reader(fp))
-        all_rows = []
-        for i in range(0, len(rows[:limit]), chunk_size):
-            all_rows.append([tuple(row.values()) for row in rows[i : i + chunk_size]])
-        return all_rows
-
-
-def get_data_as_tuples(path, limit: int = -1) -> list[tuple[Row]]:
-    with open(path, "r") as fp:
-        row_reader = jsonlines.Reader(fp)
-        all_rows = [tuple(row.values()) for row in list(row_reader)[:limit]]
-        return all_rows
-
-
-def get_data_as_csv(path, limit: int = -1) -> io.StringIO:
-    with open(path, "r") as fp:
-        row_reader = jsonlines.Reader(fp)
-        all_rows = [
-            "\t".join([str(item).replace("\t", "\\t") for item in list(row.values())])
-            .replace("\\0", "")
-            .replace("\\", "\\\\")
-            .replace("\r", "\\r")
-            .replace("\n", "\\n")
-            for row in list(row_reader)[:limit]
-        ]
-        return all_rows
+) -> Iterator[list[tuple[Row]]]:
+    yield from chunked(get_data_as_tuples(path, limit=limit), chunk_size)
+
+
+def get_data_as_tuples(path, limit: int = -1) -> Iterator[tuple[Row]]:
+    for row in iter_rows(path, limit=limit):
+        yield tuple(row.values())
+
+
+def get_data_as_csv(path, limit: int = -1) -> Iterator[str]:
+    for row in get_data_as_tuples(path, limit=limit):
+        yield escape_text_row(row)
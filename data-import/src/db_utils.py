@@ -2,10 +2,20 @@ import psycopg2.extras
 import io
 import os
 import select
+import weakref
 
 from constants import TABLE_NAME
+from utils import record_latency
+from copy_utils import COPY_COLUMNS
 from my_types import Row
 
+# (author, text, likes, video_id) per row, PG allows at most 65535 parameters
+ROW_PARAMS = 4
+MAX_PLAN_ROWS = 65535 // ROW_PARAMS
+
+# prepared statements live in the session, names are remembered per connection
+_prepared_plans: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
 
 def create_aconn():
     keepalive_kwargs = {
@@ -51,7 +61,18 @@ def close_pg_aconn_pool(pool):
         p.close()
 
 
-def create_table(connection, table_name: str = TABLE_NAME):
+def embed_column_type() -> str:
+    """
+    embed column type of the EMBED_STORAGE env storage profile shared with
+    update_with_embed, "<dims>-<float32|float16>", default vector(768)
+    """
+    dims, _, dtype = os.environ.get("EMBED_STORAGE", "768-float32").partition("-")
+    return f"{'halfvec' if dtype == 'float16' else 'vector'}({int(dims)})"
+
+
+def create_table(
+    connection, table_name: str = TABLE_NAME, embed_type: str | None = None
+):
     with connection.cursor() as cursor:
         query = """
             DROP TABLE IF EXISTS {table_name} CASCADE;
@@ -60,10 +81,19 @@ def create_table(connection, table_name: str = TABLE_NAME):
                 author              TEXT,
                 text                TEXT,
                 likes               INTEGER,
-                embed               vector(768)
+                embed               {embed_type},
+                idx                 UUID DEFAULT gen_random_uuid(),
+                text_sha256         BYTEA
             );
         """
-        cursor.execute(query.format_map({"table_name": table_name}))
+        cursor.execute(
+            query.format_map(
+                {
+                    "table_name": table_name,
+                    "embed_type": embed_type or embed_column_type(),
+                }
+            )
+        )
 
 
 def wait(conn):
@@ -95,6 +125,7 @@ def async_pg_select_sleep(pg_aconn_pool):
         pg_aconn_pool.putconn(aconn)
 
 
+@record_latency
 def insert_into_pool(pg_aconn_pool, chunk: list[tuple[Row]], chunk_id: int):
     conn = pg_aconn_pool.getconn()
     curs = conn.cursor()
@@ -111,6 +142,7 @@ def insert_into_pool(pg_aconn_pool, chunk: list[tuple[Row]], chunk_id: int):
         pg_aconn_pool.putconn(conn)
 
 
+@record_latency
 def insert_into(connection, chunk: list[tuple[Row]], chunk_id: int):
     with connection.cursor() as curs:
         query = f"""
@@ -123,19 +155,72 @@ def insert_into(connection, chunk: list[tuple[Row]], chunk_id: int):
             print(e)
 
 
-def prepare_insert_into(connection):
+def prepare_insert_into(connection, batch_size: int = 1) -> str:
+    """
+    Prepares multi-row INSERT plan for `batch_size` rows, once per connection
+
+    returns name of the plan
+    """
+    plan = f"insert_plan_{batch_size}"
+    prepared = _prepared_plans.setdefault(connection, set())
+    if plan in prepared:
+        return plan
+    params = (f"${i + 1}" for i in range(ROW_PARAMS * batch_size))
+    values = ", ".join(
+        f"({', '.join(row_params)})" for row_params in zip(*[params] * ROW_PARAMS)
+    )
     with connection.cursor() as cursor:
         cursor.execute(
             f"""
-                PREPARE insert_plan (text, text, int, text) AS
-                INSERT INTO {TABLE_NAME} (author, text, likes, video_id) VALUES($1, $2, $3, $4)
+                PREPARE {plan} ({', '.join(["text, text, int, text"] * batch_size)}) AS
+                INSERT INTO {TABLE_NAME} (author, text, likes, video_id) VALUES {values}
             """
         )
+    prepared.add(plan)
+    return plan
+
 
+@record_latency
+def execute_insert_plan(connection, chunk: list[tuple[Row]], chunk_id: int):
+    """
+    Inserts chunk by EXECUTE of prepared multi-row plan, one statement per
+    MAX_PLAN_ROWS rows
+    """
+    with connection.cursor() as curs:
+        try:
+            for i in range(0, len(chunk), MAX_PLAN_ROWS):
+                batch = chunk[i : i + MAX_PLAN_ROWS]
+                plan = prepare_insert_into(connection, len(batch))
+                placeholders = ", ".join(["%s"] * (ROW_PARAMS * len(batch)))
+                curs.execute(
+                    f"EXECUTE {plan} ({placeholders})",
+                    [value for row in batch for value in row],
+                )
+            return f"done: {chunk_id}"
+        except Exception as e:
+            print(e)
 
-def copy_from(connection, chunk: io.TextIOBase):
-    chunk.seek(io.SEEK_SET)
+
+@record_latency
+def copy_from(connection, chunk: io.IOBase):
+    if chunk.seekable():
+        chunk.seek(io.SEEK_SET)
     with connection.cursor() as cursor:
         cursor.copy_from(
             chunk, TABLE_NAME, sep="\t", columns=("author", "text", "likes", "video_id")
         )
+        return cursor.rowcount
+
+
+@record_latency
+def copy_binary(connection, chunk: io.IOBase, columns=COPY_COLUMNS):
+    if chunk.seekable():
+        chunk.seek(io.SEEK_SET)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"""
+                COPY {TABLE_NAME} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)
+            """,
+            chunk,
+        )
+        return cursor.rowcount
@@ -0,0 +1,162 @@
+from typing import Callable
+
+from utils import measure_phase
+from my_types import LoadProfile
+from db_utils import create_table, embed_column_type
+from constants import TABLE_NAME
+
+
+def default_load_profile(max_parallel_maintenance_workers: int) -> LoadProfile:
+    """
+    max_parallel_maintenance_workers: int, workers of every index build,
+    capped by max_worker_processes and max_parallel_workers of the server
+    """
+    return {
+        "maintenance_work_mem": "2GB",
+        "max_parallel_maintenance_workers": max_parallel_maintenance_workers,
+        "pk_index": True,
+        "vector_index": None,
+        "vector_index_options": "",
+        "set_logged": False,
+    }
+
+
+# prefixed by the embed column type, vector_cosine_ops or halfvec_cosine_ops
+VECTOR_INDEX_OPS = {
+    "hnsw": "cosine_ops",
+    "ivfflat": "cosine_ops",
+}
+
+
+def defer_indexes(connection, table_name: str = TABLE_NAME) -> list[str]:
+    """
+    Drops constraints and secondary indexes of the table before the load
+
+    returns statements which rebuild them, in dependency order
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", (table_name,))
+        if cursor.fetchone()[0] is None:
+            return []
+
+        cursor.execute(
+            """
+                SELECT conname, pg_get_constraintdef(oid)
+                FROM pg_constraint
+                WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f', 'x')
+                ORDER BY contype = 'f' DESC
+            """,
+            (table_name,),
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(
+            """
+                SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+                FROM pg_index i
+                LEFT JOIN pg_constraint c ON c.conindid = i.indexrelid
+                WHERE i.indrelid = %s::regclass AND c.oid IS NULL
+            """,
+            (table_name,),
+        )
+        indexes = cursor.fetchall()
+
+        for name, _ in constraints:
+            cursor.execute(f'ALTER TABLE {table_name} DROP CONSTRAINT "{name}"')
+        for name, _ in indexes:
+            cursor.execute(f"DROP INDEX {name}")
+
+    # indexes first, so unique/primary key constraints validate against them
+    return [definition for _, definition in indexes] + [
+        f'ALTER TABLE {table_name} ADD CONSTRAINT "{name}" {definition}'
+        for name, definition in reversed(constraints)
+    ]
+
+
+def tune_maintenance(connection, profile: LoadProfile):
+    with connection.cursor() as cursor:
+        if "maintenance_work_mem" in profile:
+            cursor.execute(
+                "SELECT set_config('maintenance_work_mem', %s, false)",
+                (profile["maintenance_work_mem"],),
+            )
+        if "max_parallel_maintenance_workers" in profile:
+            cursor.execute(
+                "SELECT set_config('max_parallel_maintenance_workers', %s, false)",
+                (str(profile["max_parallel_maintenance_workers"]),),
+            )
+
+
+def build_indexes(
+    connection,
+    profile: LoadProfile,
+    deferred: list[str],
+    table_name: str = TABLE_NAME,
+):
+    with connection.cursor() as cursor:
+        for statement in deferred:
+            cursor.execute(statement)
+        if profile.get("pk_index"):
+            cursor.execute(
+                f"""
+                    CREATE UNIQUE INDEX IF NOT EXISTS pk_index
+                        ON {table_name} USING btree
+                        (idx)
+                        WITH (deduplicate_items=False)
+                """
+            )
+        if method := profile.get("vector_index"):
+            options = profile.get("vector_index_options", "")
+            column_type = embed_column_type().split("(")[0]
+            cursor.execute(
+                f"""
+                    CREATE INDEX IF NOT EXISTS {table_name}_embed_{method}_index
+                        ON {table_name} USING {method}
+                        (embed {column_type}_{VECTOR_INDEX_OPS[method]})
+                        {f"WITH ({options})" if options else ""}
+                """
+            )
+
+
+def set_logged(connection, table_name: str = TABLE_NAME):
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {table_name} SET LOGGED")
+
+
+def load_with_profile(
+    connection,
+    load: Callable[[], None],
+    profile: LoadProfile,
+    table_name: str = TABLE_NAME,
+    create: bool = True,
+) -> dict[str, float]:
+    """
+    params:
+    connection: PG connector in autocommit mode
+    load: Callable, runs the import itself into the existing table and must not
+          recreate it, e.g. partial(seq_copy_from, conn, ..., create=False)
+    profile: LoadProfile, maintenance settings and indexes built after the load,
+             e.g. default_load_profile(max_parallel_maintenance_workers=8)
+    create: bool, (re)create the empty table first, otherwise load into
+            the existing one
+
+    Runs the load between deferring indexes and building them, every phase
+    is timed separately
+
+    returns seconds per phase
+    """
+    timings = {}
+    if create:
+        with measure_phase("create_table", timings):
+            create_table(connection, table_name)
+    with measure_phase("defer_indexes", timings):
+        deferred = defer_indexes(connection, table_name)
+    with measure_phase("tune_maintenance", timings):
+        tune_maintenance(connection, profile)
+    with measure_phase("load", timings):
+        load()
+    with measure_phase("build_indexes", timings):
+        build_indexes(connection, profile, deferred, table_name)
+    if profile.get("set_logged"):
+        with measure_phase("set_logged", timings):
+            set_logged(connection, table_name)
+    return timings
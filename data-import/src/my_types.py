@@ -6,3 +6,12 @@ class Row(TypedDict):
     author: str
     text: str
     likes: int
+
+
+class LoadProfile(TypedDict, total=False):
+    maintenance_work_mem: str
+    max_parallel_maintenance_workers: int
+    pk_index: bool
+    vector_index: str | None
+    vector_index_options: str
+    set_logged: bool
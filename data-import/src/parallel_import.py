@@ -1,33 +1,57 @@
 from functools import partial
+import io
 import os
+import queue
+import threading
 import psycopg2
 from dotenv import load_dotenv
 import time
 
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable
 
 import psycopg2.pool
 
-from utils import async_measure
+from utils import (
+    async_measure,
+    extend_latencies,
+    measure,
+    pop_latencies,
+    read_psql_config,
+)
 from db_utils import (
+    create_connection,
     create_table,
     insert_into_pool,
     async_pg_select_sleep,
+    copy_binary,
 )
+from copy_utils import binary_copy_stream, encode_json_lines
 from my_types import Row
-from data_utils import get_data_as_tuples_chunked
+from data_utils import (
+    chunked,
+    get_data_as_tuples_chunked,
+    iter_raw_lines,
+    iter_rows_in_range,
+    split_byte_ranges,
+)
 from constants import DATA_JSONL_PATH, TABLE_NAME
 
 
-def async_insert_into(glob_conn, executor, chunk_size: int, limit: int = -1):
+def async_insert_into(
+    glob_conn, executor, chunk_size: int, limit: int = -1, create: bool = True
+):
     """
     params:
     connection: PG connector
     chunk_size: int, number of rows inserted to pg in single query
     limit: int, total number of rows to be insterted to pg
+    create: bool, (re)create the table, False loads into the existing one
     """
-    create_table(glob_conn, TABLE_NAME)
+    if create:
+        create_table(glob_conn, TABLE_NAME)
     data = get_data_as_tuples_chunked(
         DATA_JSONL_PATH, limit=limit, chunk_size=chunk_size
     )
@@ -55,17 +79,202 @@ def async_insert_into(glob_conn, executor, chunk_size: int, limit: int = -1):
 
 
 # @async_measure
-async def run_insert_into_loop(executor, pg_aconn_pool, data: list[list[tuple[Row]]]):
+async def run_insert_into_loop(
+    executor, pg_aconn_pool, data: Iterable[list[tuple[Row]]]
+):
     """
     params:
-    data: list[list[tuple[Row]]], list of (author, text, likes, video_id) tuples
+    data: Iterable[list[tuple[Row]]], stream of (author, text, likes, video_id) chunks
+
+    At most 2 chunks per executor worker are in flight, so chunks are read
+    from the stream only as fast as PG consumes them.
     """
     loop = asyncio.get_event_loop()
-    tasks = [
-        loop.run_in_executor(executor, insert_into_pool, pg_aconn_pool, chunk)
-        for chunk in data
+    max_in_flight = 2 * executor._max_workers
+    tasks = set()
+    for chunk_id, chunk in enumerate(data):
+        if len(tasks) >= max_in_flight:
+            _, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        tasks.add(
+            loop.run_in_executor(
+                executor, insert_into_pool, pg_aconn_pool, chunk, chunk_id
+            )
+        )
+    if tasks:
+        _ = await asyncio.gather(*tasks)
+
+
+def parallel_copy_from(
+    glob_conn,
+    chunk_size: int,
+    num_workers: int = -1,
+    limit: int = -1,
+    create: bool = True,
+):
+    """
+    params:
+    connection: PG connector
+    chunk_size: int, number of rows sent to pg in single COPY,
+                chunk_size < 0 streams whole slice through single COPY
+    num_workers: int, number of worker processes, each with own PG connection,
+                 capped by (and defaults to) max_parallel_workers from psql-config
+    limit: int, total number of rows to be insterted to pg
+    create: bool, (re)create the table, False loads into the existing one
+    """
+    max_workers = int(read_psql_config()["max_parallel_workers"])
+    if num_workers < 0 or num_workers > max_workers:
+        num_workers = max_workers
+    # raises for compressed input, before the table is dropped
+    byte_ranges = split_byte_ranges(DATA_JSONL_PATH, num_workers, limit)
+    if create:
+        create_table(glob_conn, TABLE_NAME)
+    rows = run_copy_ranges_loop(byte_ranges, chunk_size=chunk_size)
+    print(f"copied {rows} rows by {len(byte_ranges)} workers")
+
+
+@measure
+def run_copy_ranges_loop(byte_ranges: list[tuple[int, int]], chunk_size: int):
+    """
+    params:
+    byte_ranges: list[tuple[int, int]], newline aligned (start, end) slices of input
+    chunk_size: int, number of rows sent to pg in single COPY
+    """
+    if not byte_ranges:
+        return 0
+    with ProcessPoolExecutor(max_workers=len(byte_ranges)) as executor:
+        futures = [
+            executor.submit(copy_byte_range, DATA_JSONL_PATH, start, end, chunk_size)
+            for start, end in byte_ranges
+        ]
+        rows = 0
+        for future in futures:
+            range_rows, latencies = future.result()
+            rows += range_rows
+            extend_latencies(latencies)
+        return rows
+
+
+def copy_byte_range(
+    path, start: int, end: int, chunk_size: int
+) -> tuple[int, list[float]]:
+    """
+    Worker: parses own slice of the JSONL file and streams it by binary COPY
+    through own connection, commits once the whole slice is copied
+
+    returns (number of rows, per chunk latencies recorded in this worker)
+    """
+    conn = create_connection()
+    rows = 0
+    try:
+        data = (tuple(row.values()) for row in iter_rows_in_range(path, start, end))
+        chunks = [data] if chunk_size < 0 else chunked(data, chunk_size)
+        for chunk in chunks:
+            rows += copy_binary(conn, binary_copy_stream(chunk))
+        conn.commit()
+        return rows, pop_latencies()
+    finally:
+        conn.close()
+
+
+def pipeline_copy_from(
+    glob_conn,
+    chunk_size: int,
+    num_parsers: int = -1,
+    num_writers: int = 4,
+    queue_size: int = 8,
+    limit: int = -1,
+    create: bool = True,
+):
+    """
+    params:
+    connection: PG connector
+    chunk_size: int, number of rows sent to pg in single COPY
+    num_parsers: int, parse/encode processes, defaults to cpu count
+    num_writers: int, COPY writer threads, each with own PG connection
+    queue_size: int, max encoded chunks waiting for a writer
+    limit: int, total number of rows to be insterted to pg
+    create: bool, (re)create the table, False loads into the existing one
+    """
+    if create:
+        create_table(glob_conn, TABLE_NAME)
+    if num_parsers < 0:
+        num_parsers = os.cpu_count()
+    rows = run_pipeline_loop(
+        num_parsers, num_writers, queue_size, chunk_size=chunk_size, limit=limit
+    )
+    print(f"copied {rows} rows by {num_parsers} parsers and {num_writers} writers")
+
+
+@measure
+def run_pipeline_loop(
+    num_parsers: int, num_writers: int, queue_size: int, chunk_size: int, limit: int
+):
+    """
+    Two stage pipeline: processes decode JSON and encode binary COPY payloads,
+    writer threads send them. Encoded chunks pass through a bounded queue, so
+    when PG is slow the reader blocks instead of piling up parsed chunks.
+    """
+    buffers = queue.Queue(maxsize=queue_size)
+    errors = []
+    writers = [
+        threading.Thread(target=copy_writer, args=[buffers, errors])
+        for _ in range(num_writers)
     ]
-    _ = await asyncio.gather(*tasks)
+    for writer in writers:
+        writer.start()
+
+    rows = 0
+    try:
+        with ProcessPoolExecutor(max_workers=num_parsers) as executor:
+            pending = deque()
+            raw_chunks = chunked(iter_raw_lines(DATA_JSONL_PATH, limit), chunk_size)
+            for lines in raw_chunks:
+                if errors:
+                    break
+                pending.append(executor.submit(encode_json_lines, lines))
+                if len(pending) >= 2 * num_parsers:
+                    chunk_rows, payload = pending.popleft().result()
+                    buffers.put(payload)
+                    rows += chunk_rows
+            while pending:
+                chunk_rows, payload = pending.popleft().result()
+                buffers.put(payload)
+                rows += chunk_rows
+    finally:
+        for _ in writers:
+            buffers.put(None)
+        for writer in writers:
+            writer.join()
+
+    if errors:
+        raise errors[0]
+    return rows
+
+
+def copy_writer(buffers: queue.Queue, errors: list):
+    """
+    Writer thread: COPYs payloads from `buffers` until None is received,
+    keeps draining after a failure, also a failed connect, so the reader
+    never blocks on a full queue
+    """
+    conn = None
+    try:
+        conn = create_connection()
+    except Exception as e:
+        errors.append(e)
+    try:
+        while (payload := buffers.get()) is not None:
+            if errors:
+                continue
+            try:
+                copy_binary(conn, io.BytesIO(payload))
+            except Exception as e:
+                errors.append(e)
+        if not errors:
+            conn.commit()
+    finally:
+        if conn is not None:
+            conn.close()
 
 
 def async_sleep(executor, num_sleeps=1):
@@ -116,5 +325,7 @@ if __name__ == "__main__":
 
     executor = ThreadPoolExecutor(max_workers=10)
     async_insert_into(glob_conn, executor, chunk_size=1000, limit=-1)
+    # parallel_copy_from(glob_conn, chunk_size=10_000)
+    # pipeline_copy_from(glob_conn, chunk_size=10_000)
 
     glob_conn.close()
@@ -0,0 +1,95 @@
+import os
+from typing import Iterable
+
+import psycopg
+import psycopg2
+from dotenv import load_dotenv
+
+from utils import measure, record_latency
+from db_utils import create_table
+from my_types import Row
+from data_utils import chunked, get_data_as_tuples
+from constants import DATA_JSONL_PATH, TABLE_NAME
+
+
+INSERT_QUERY = f"""
+    INSERT INTO {TABLE_NAME} (author, text, likes, video_id) VALUES (%s, %s, %s, %s)
+"""
+
+
+def create_pipeline_connection() -> psycopg.Connection:
+    """
+    psycopg 3 connection, libpq pipeline mode is not available in psycopg2
+    """
+    return psycopg.connect(
+        host="localhost",
+        port=os.environ["PG_PORT"],
+        dbname="pgvector-test",
+        user=os.environ["PG_USER"],
+        password=os.environ["PG_PASSWORD"],
+    )
+
+
+def seq_insert_into_pipeline(
+    glob_conn, chunk_size: int, limit: int = -1, create: bool = True
+):
+    """
+    params:
+    connection: PG connector
+    chunk_size: int, number of rows sent to pg before waiting for their results
+    limit: int, total number of rows to be insterted to pg
+    create: bool, (re)create the table, False loads into the existing one
+    """
+    if create:
+        create_table(glob_conn, TABLE_NAME)
+    data = get_data_as_tuples(DATA_JSONL_PATH, limit=limit)
+    with create_pipeline_connection() as pipeline_conn:
+        run_pipeline_insert_loop(pipeline_conn, data, chunk_size=chunk_size)
+
+
+@measure
+def run_pipeline_insert_loop(
+    pipeline_conn: psycopg.Connection, data: Iterable[tuple[Row]], chunk_size: int
+):
+    """
+    params:
+    pipeline_conn: psycopg 3 connection
+    data: Iterable[tuple[Row]], stream of (author, text, likes, video_id) tuples
+    chunk_size: int, number of rows sent to pg before waiting for their results
+
+    Single row INSERTs are queued in pipeline mode, the only round trip
+    is the sync at the end of each chunk
+    """
+    with pipeline_conn.pipeline() as pipeline:
+        with pipeline_conn.cursor() as cursor:
+            for chunk in chunked(data, chunk_size):
+                pipeline_insert_chunk(pipeline, cursor, chunk)
+    pipeline_conn.commit()
+
+
+@record_latency
+def pipeline_insert_chunk(
+    pipeline: psycopg.Pipeline, cursor: psycopg.Cursor, chunk: list[tuple[Row]]
+):
+    for row in chunk:
+        cursor.execute(INSERT_QUERY, row, prepare=True)
+    pipeline.sync()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    conn = psycopg2.connect(
+        host="localhost",
+        port=os.environ["PG_PORT"],
+        database="pgvector-test",
+        user=os.environ["PG_USER"],
+        password=os.environ["PG_PASSWORD"],
+    )
+    conn.autocommit = True
+
+    if not conn.closed:
+        print("Connected to postgres\n")
+
+    seq_insert_into_pipeline(conn, chunk_size=1000)
+
+    conn.close()
@@ -1,5 +1,5 @@
 import os
-import io
+from typing import Iterable
 import psycopg2
 from dotenv import load_dotenv
 
@@ -7,85 +7,127 @@ from utils import measure
 from db_utils import (
     create_table,
     insert_into,
+    execute_insert_plan,
     copy_from,
-    prepare_insert_into,
+    copy_binary,
 )
+from copy_utils import CopyStream, binary_copy_stream
 from my_types import Row
-from data_utils import get_data_as_tuples, get_data_as_csv
+from data_utils import chunked, get_data_as_tuples
 from constants import DATA_JSONL_PATH, TABLE_NAME
 
 
-def seq_insert_into(connection, chunk_size: int, limit: int = -1):
+def seq_insert_into(
+    connection, chunk_size: int, limit: int = -1, create: bool = True
+):
     """
     params:
     connection: PG connector
     chunk_size: int, number of rows inserted to pg in single query
     limit: int, total number of rows to be insterted to pg
+    create: bool, (re)create the table, False loads into the existing one
     """
-    create_table(connection, TABLE_NAME)
+    if create:
+        create_table(connection, TABLE_NAME)
     data = get_data_as_tuples(DATA_JSONL_PATH, limit=limit)
     run_insert_into_loop(connection, data, chunk_size=chunk_size)
 
 
-def seq_insert_into_prepared(connection, chunk_size: int, limit: int = -1):
+def seq_insert_into_prepared(
+    connection, chunk_size: int, limit: int = -1, create: bool = True
+):
     """
     params:
     connection: PG connector
-    chunk_size: int, number of rows inserted to pg in single query
+    chunk_size: int, number of rows inserted to pg in single EXECUTE of
+                multi-row plan prepared for that many rows
     limit: int, total number of rows to be insterted to pg
+    create: bool, (re)create the table, False loads into the existing one
     """
-    create_table(connection, TABLE_NAME)
-    prepare_insert_into(connection)
+    if create:
+        create_table(connection, TABLE_NAME)
     data = get_data_as_tuples(DATA_JSONL_PATH, limit=limit)
-    run_insert_into_loop(connection, data, chunk_size=chunk_size)
+    run_execute_plan_loop(connection, data, chunk_size=chunk_size)
 
 
 @measure
-def run_insert_into_loop(connection, data: list[tuple[Row]], chunk_size: int):
+def run_insert_into_loop(connection, data: Iterable[tuple[Row]], chunk_size: int):
     """
     params:
     connection: PG connector
-    data: tuple[Row], list of (author, text, likes, video_id) tuples
+    data: Iterable[tuple[Row]], stream of (author, text, likes, video_id) tuples
     chunk_size: int, number of rows inserted to PG in single query
     """
-    if chunk_size < 0:
-        insert_into(connection, data)
-    for i in range(0, len(data), chunk_size):
-        chunk = data[i : i + chunk_size]
-        insert_into(connection, chunk)
+    for chunk_id, chunk in enumerate(chunked(data, chunk_size)):
+        insert_into(connection, chunk, chunk_id)
+
+
+@measure
+def run_execute_plan_loop(connection, data: Iterable[tuple[Row]], chunk_size: int):
+    """
+    params:
+    connection: PG connector
+    data: Iterable[tuple[Row]], stream of (author, text, likes, video_id) tuples
+    chunk_size: int, number of rows inserted to PG in single query
+    """
+    for chunk_id, chunk in enumerate(chunked(data, chunk_size)):
+        execute_insert_plan(connection, chunk, chunk_id)
 
 
-def seq_copy_from(connection, chunk_size: int, limit: int = -1):
+def seq_copy_from(
+    connection,
+    chunk_size: int,
+    limit: int = -1,
+    binary: bool = False,
+    create: bool = True,
+):
     """
     params:
     connection: PG connector
     chunk_size: int, number of rows inserted to pg in single query
     limit: int, total number of rows to be insterted to pg
+    binary: bool, use COPY ... (FORMAT binary) instead of escaped TSV
+    create: bool, (re)create the table, False loads into the existing one
     """
-    create_table(connection, TABLE_NAME)
-    data = get_data_as_csv(DATA_JSONL_PATH, limit=limit)
-    run_copy_from_loop(connection, data, chunk_size=chunk_size)
+    if create:
+        create_table(connection, TABLE_NAME)
+    data = get_data_as_tuples(DATA_JSONL_PATH, limit=limit)
+    if binary:
+        run_copy_binary_loop(connection, data, chunk_size=chunk_size)
+    else:
+        run_copy_from_loop(connection, data, chunk_size=chunk_size)
 
 
 @measure
-def run_copy_from_loop(connection, data: list[str], chunk_size: int):
+def run_copy_from_loop(connection, data: Iterable[tuple[Row]], chunk_size: int):
     """
     params:
     connection: PG connector
-    data: tuple[Row], list of (author, text, likes, video_id) tuples
-    chunk_size: int, number of rows inserted to PG in single query
+    data: Iterable[tuple[Row]], stream of (author, text, likes, video_id) tuples
+    chunk_size: int, number of rows inserted to PG in single query,
+                chunk_size < 0 streams all rows through single COPY
     """
     if chunk_size < 0:
-        csv_ = io.StringIO()
-        csv_.write("\n".join(data))
-        copy_from(connection, csv_)
-        csv_.close()
-    else:
-        for i in range(0, len(data), chunk_size):
-            csv_ = io.StringIO()
-            csv_.write("\n".join(data[i : i + chunk_size]))
-            copy_from(connection, csv_)
-            csv_.close()
+        copy_from(connection, CopyStream(data))
+        return
+    for chunk in chunked(data, chunk_size):
+        copy_from(connection, CopyStream(chunk))
+
+
+@measure
+def run_copy_binary_loop(connection, data: Iterable[tuple[Row]], chunk_size: int):
+    """
+    params:
+    connection: PG connector
+    data: Iterable[tuple[Row]], stream of (author, text, likes, video_id) tuples
+    chunk_size: int, number of rows inserted to PG in single query,
+                chunk_size < 0 streams all rows through single COPY
+    """
+    if chunk_size < 0:
+        copy_binary(connection, binary_copy_stream(data))
+        return
+    for chunk in chunked(data, chunk_size):
+        copy_binary(connection, binary_copy_stream(chunk))
 
 
 if __name__ == "__main__":
@@ -112,6 +154,7 @@ if __name__ == "__main__":
     # seq_insert_into_prepared(conn, chunk_size=10)
 
     seq_copy_from(conn, chunk_size=-1)
+    # seq_copy_from(conn, chunk_size=-1, binary=True)
     # seq_copy_from(conn, chunk_size=1)
     # seq_copy_from(conn, chunk_size=5)
     # seq_copy_from(conn, chunk_size=10)
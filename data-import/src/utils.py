@@ -1,7 +1,10 @@
+import inspect
+import os
 import time
+from contextlib import contextmanager
 from functools import wraps
 
-from constants import TIME_LOG_PATH
+from constants import TIME_LOG_PATH, PSQL_CONFIG_PATH
 
 
 def measure(func):
@@ -38,3 +41,92 @@ def async_measure(func):
         return result
 
     return measure_wrapper
+
+
+def read_psql_config(path: str = PSQL_CONFIG_PATH) -> dict[str, str]:
+    """
+    Parses `key = value` lines of postgresql.conf style file
+    """
+    config = {}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if "=" in line:
+                key, value = line.split("=", 1)
+                config[key.strip()] = value.strip()
+    return config
+
+
+def log_throughput(name: str, chunk_size, rows: int, seconds: float):
+    print(f"{name} {chunk_size} -> {rows / seconds} rows/s")
+    with open(TIME_LOG_PATH, "a") as f:
+        f.write(f"{name} {chunk_size} -> {rows / seconds} rows/s\n")
+
+
+@contextmanager
+def measure_phase(name: str, timings: dict[str, float]):
+    """
+    Times the enclosed block, stores seconds in timings[name] and logs
+    it the same way as measure
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        timings[name] = end - start
+        print(f"{name} -> {1000*(end - start)} ms")
+        with open(TIME_LOG_PATH, "a") as f:
+            f.write(f"{name} -> {1000*(end - start)} ms\n")
+
+
+LATENCY_ENV = "IMPORT_RECORD_LATENCY"
+_latencies: list[float] = []
+
+
+def record_latency(func):
+    """
+    Records duration of every call while latency recording is on,
+    environment flag so that worker processes record too
+    """
+
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_latency_wrapper(*args, **kwargs):
+            if not os.environ.get(LATENCY_ENV):
+                return await func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _latencies.append(time.perf_counter() - start)
+
+        return async_latency_wrapper
+
+    @wraps(func)
+    def latency_wrapper(*args, **kwargs):
+        if not os.environ.get(LATENCY_ENV):
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _latencies.append(time.perf_counter() - start)
+
+    return latency_wrapper
+
+
+def start_latency_recording():
+    os.environ[LATENCY_ENV] = "1"
+    _latencies.clear()
+
+
+def pop_latencies() -> list[float]:
+    latencies = _latencies.copy()
+    _latencies.clear()
+    return latencies
+
+
+def extend_latencies(latencies: list[float]):
+    _latencies.extend(latencies)
@@ -0,0 +1,106 @@
+import argparse
+import time
+
+from dotenv import load_dotenv
+
+from utils.db_utils import open_pg_conn, sample_texts
+from utils.local_encoder import (
+    BATCH_TOKENS,
+    MAX_BATCH_SIZE,
+    MAX_SEQ_LENGTH,
+    get_model,
+    length_buckets,
+    padding_efficiency,
+    token_lengths,
+)
+from pg_embed_server import encode_texts
+
+# rows the server gets per frame, pg_client_feed sends CHUNK_SIZE / workers
+FRAME_SIZE = 2_500
+
+
+def frames(texts: list[str], frame_size: int) -> list[list[str]]:
+    return [texts[i : i + frame_size] for i in range(0, len(texts), frame_size)]
+
+
+def encode_arrival_order(model, texts: list[str], max_batch_size: int):
+    """
+    batches in order of arrival, as the server did before bucketing
+    """
+    for i in range(0, len(texts), max_batch_size):
+        batch = texts[i : i + max_batch_size]
+        model.encode(batch, batch_size=len(batch), convert_to_numpy=True)
+
+
+def encode_server(texts: list[str], frame_size: int, max_batch_size: int):
+    """
+    encodes every frame as pg_embed_server.serve_connection does,
+    without the cache and the write back
+    """
+    for frame in frames(texts, frame_size):
+        encode_texts(frame, max_batch_size)
+
+
+def bench(model, texts: list[str], frame_size: int, max_batch_size: int, repeat: int):
+    """
+    returns {method: (best embeddings/s, padding efficiency)}
+    """
+    lengths = token_lengths(model, texts)
+    arrival = [
+        list(range(i, min(i + max_batch_size, len(texts))))
+        for i in range(0, len(texts), max_batch_size)
+    ]
+    server = [
+        [offset + i for i in bucket]
+        for offset in range(0, len(texts), frame_size)
+        for bucket in length_buckets(
+            lengths[offset : offset + frame_size], max_batch_size, BATCH_TOKENS
+        )
+    ]
+    methods = {
+        "arrival": (
+            lambda: encode_arrival_order(model, texts, max_batch_size),
+            padding_efficiency(lengths, arrival),
+        ),
+        "server": (
+            lambda: encode_server(texts, frame_size, max_batch_size),
+            padding_efficiency(lengths, server),
+        ),
+    }
+    results = {}
+    for name, (encode, efficiency) in methods.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encode()
+            best = min(best, time.perf_counter() - start)
+        results[name] = (len(texts) / best, efficiency)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares local embedding throughput of arrival order "
+        "batches and of the server's token length bucketing on sampled comments"
+    )
+    parser.add_argument("--rows", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--frame-size", type=int, default=FRAME_SIZE)
+    parser.add_argument("--max-seq-length", type=int, default=MAX_SEQ_LENGTH)
+    args = parser.parse_args()
+
+    load_dotenv()
+    pg_conn = open_pg_conn()
+    texts = sample_texts(pg_conn, args.rows)
+    pg_conn.close()
+
+    # same model instance encode_texts of the server uses
+    model = get_model()
+    model.max_seq_length = args.max_seq_length
+    results = bench(model, texts, args.frame_size, args.max_batch_size, args.repeat)
+    for name, (per_s, efficiency) in results.items():
+        print(
+            f"{name}: {per_s:.1f} embeddings/s, "
+            f"{100 * efficiency:.0f}% of computed tokens are not padding"
+        )
@@ -0,0 +1,171 @@
+import argparse
+import csv
+import json
+from itertools import product
+
+from dotenv import load_dotenv
+
+from utils.bulk_update import EMBED_TABLE
+from utils.db_utils import open_pg_conn
+from utils.search import (
+    HNSW_EF_CONSTRUCTION,
+    HNSW_M,
+    IVFFLAT_LISTS,
+    build_index,
+    drop_vector_indexes,
+    latency_stats,
+    recall_at_k,
+    run_queries,
+    sample_query_rows,
+    set_search_params,
+)
+
+# indexes are built on this copy, so indexes of the live table stay untouched
+BENCH_TABLE = f"{EMBED_TABLE}_bench_search"
+RESULT_FIELDS = [
+    "method",
+    "m",
+    "ef_construction",
+    "lists",
+    "ef_search",
+    "probes",
+    "build_s",
+    "index_mb",
+    "recall",
+    "qps",
+    "p50_ms",
+    "p99_ms",
+]
+
+
+def build_params(args) -> list[dict]:
+    params = []
+    if "hnsw" in args.methods:
+        params += [
+            {"method": "hnsw", "m": m, "ef_construction": ef_construction}
+            for m, ef_construction in product(args.m, args.ef_construction)
+        ]
+    if "ivfflat" in args.methods:
+        params += [{"method": "ivfflat", "lists": lists} for lists in args.lists]
+    return params
+
+
+def search_params(method: str, args) -> list[dict]:
+    if method == "hnsw":
+        return [{"ef_search": ef_search} for ef_search in args.ef_search]
+    return [{"probes": probes} for probes in args.probes]
+
+
+def copy_bench_table(cur, rows: int, held_out: list[str]):
+    """
+    copies idx and embed of embedded rows, rows < 0 means all, into BENCH_TABLE,
+    except `held_out` query rows
+    """
+    cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+    cur.execute(
+        f"""
+            CREATE TABLE {BENCH_TABLE} AS
+            SELECT idx, embed FROM {EMBED_TABLE}
+            WHERE embed IS NOT NULL AND idx <> ALL(%s::uuid[])
+            LIMIT %s
+        """,
+        (held_out, rows if rows >= 0 else None),
+    )
+    cur.execute(f"ANALYZE {BENCH_TABLE}")
+
+
+def run_sweep(pg_conn, args) -> list[dict]:
+    """
+    Every index configuration is built once, on a copy of the embedded rows,
+    and queried with every search parameter, recall@k is measured against
+    exact search of the same queries. Query rows are left out of the copy,
+    so every query gets k results of its own.
+    """
+    results = []
+    with pg_conn.cursor() as cur:
+        queries = sample_query_rows(cur, args.queries)
+        copy_bench_table(cur, args.rows, [idx for idx, _ in queries])
+
+        set_search_params(cur, exact=True)
+        truth, latencies = run_queries(cur, queries, args.k, table=BENCH_TABLE)
+        exact = {"method": "exact", "recall": 1.0, **latency_stats(latencies)}
+        print(json.dumps(exact))
+        results.append(exact)
+
+        for build in build_params(args):
+            # only the index under test may serve the queries
+            drop_vector_indexes(cur, BENCH_TABLE)
+            index = build_index(
+                cur,
+                table=BENCH_TABLE,
+                maintenance_work_mem=args.maintenance_work_mem,
+                **build,
+            )
+            for params in search_params(build["method"], args):
+                set_search_params(cur, **params)
+                found, latencies = run_queries(cur, queries, args.k, table=BENCH_TABLE)
+                result = {
+                    **build,
+                    **index,
+                    **params,
+                    "recall": recall_at_k(found, truth),
+                    **latency_stats(latencies),
+                }
+                print(json.dumps(result))
+                results.append(result)
+        if not args.keep_table:
+            cur.execute(f"DROP TABLE {BENCH_TABLE}")
+    return results
+
+
+def write_results(results: list[dict], output: str):
+    with open(f"{output}.json", "w") as f:
+        json.dump(results, f, indent=2)
+    with open(f"{output}.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def parse_int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sweeps HNSW/IVFFlat build and search parameters, reports "
+        "recall@k against exact search, QPS and p99 latency"
+    )
+    parser.add_argument(
+        "--methods", type=lambda value: value.split(","), default=["hnsw", "ivfflat"]
+    )
+    parser.add_argument("--m", type=parse_int_list, default=[HNSW_M])
+    parser.add_argument(
+        "--ef-construction", type=parse_int_list, default=[HNSW_EF_CONSTRUCTION]
+    )
+    parser.add_argument("--ef-search", type=parse_int_list, default=[10, 20, 40, 80])
+    parser.add_argument("--lists", type=parse_int_list, default=[IVFFLAT_LISTS])
+    parser.add_argument("--probes", type=parse_int_list, default=[1, 5, 10, 20])
+    parser.add_argument(
+        "--rows", type=int, default=-1, help="embedded rows copied, default all"
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--maintenance-work-mem", default="512MB")
+    parser.add_argument(
+        "--keep-table",
+        action="store_true",
+        help=f"keep {BENCH_TABLE} with the last built index",
+    )
+    parser.add_argument(
+        "--output", default=None, help="results path without extension"
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    pg_conn = open_pg_conn()
+    pg_conn.autocommit = True
+    results = run_sweep(pg_conn, args)
+    pg_conn.close()
+    if args.output:
+        write_results(results, args.output)
@@ -0,0 +1,159 @@
+import argparse
+import json
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.bulk_update import EMBED_TABLE
+from utils.db_utils import open_pg_conn
+from utils.search import latency_stats, recall_at_k, run_queries, set_search_params
+from utils.storage_profile import (
+    StorageProfile,
+    cosine_opclass,
+    parse_storage_profile,
+    profile_name,
+    truncate_embeds,
+    truncate_sql,
+)
+
+PROFILES = "768-float32,768-float16,512-float16,256-float16,128-float16"
+
+
+def profile_table(profile: StorageProfile) -> str:
+    return f"embed_profile_{profile_name(profile).replace('-', '_')}"
+
+
+def build_profile_table(cur, profile: StorageProfile, rows: int) -> dict:
+    """
+    Copies first `rows` embedded rows, truncated to `profile`, into own table
+    with HNSW index
+
+    returns index build time and table and index sizes
+    """
+    table = profile_table(profile)
+    cur.execute(f"DROP TABLE IF EXISTS {table}")
+    cur.execute(
+        f"""
+            CREATE TABLE {table} AS
+            SELECT idx, {truncate_sql("embed", profile)} AS embed
+            FROM {EMBED_TABLE} WHERE embed IS NOT NULL
+            ORDER BY idx LIMIT %s
+        """,
+        (rows,),
+    )
+    start = time.perf_counter()
+    cur.execute(
+        f"""
+            CREATE INDEX {table}_hnsw ON {table}
+            USING hnsw (embed {cosine_opclass(profile)})
+        """
+    )
+    build_s = time.perf_counter() - start
+    cur.execute(
+        "SELECT pg_table_size(%s), pg_relation_size(%s)", (table, f"{table}_hnsw")
+    )
+    table_bytes, index_bytes = cur.fetchone()
+    return {
+        "index_build_s": build_s,
+        "table_mb": table_bytes / 2**20,
+        "index_mb": index_bytes / 2**20,
+    }
+
+
+def sample_queries(cur, rows: int, num_queries: int) -> list[tuple[str, np.ndarray]]:
+    """
+    returns (idx, full size embed) of rows after the indexed ones
+    """
+    cur.execute(
+        f"""
+            SELECT idx::text, embed::vector::text FROM {EMBED_TABLE}
+            WHERE embed IS NOT NULL ORDER BY idx OFFSET %s LIMIT %s
+        """,
+        (rows, num_queries),
+    )
+    return [
+        (idx, np.array(json.loads(embed), np.float32))
+        for idx, embed in cur.fetchall()
+    ]
+
+
+def knn(cur, profile: StorageProfile, queries, k: int):
+    """
+    returns top k idx and latency of every query, truncated to `profile`
+    """
+    embeds = truncate_embeds([embed for _, embed in queries], profile)
+    return run_queries(
+        cur,
+        [(idx, embed) for (idx, _), embed in zip(queries, embeds)],
+        k,
+        table=profile_table(profile),
+        profile=profile,
+    )
+
+
+def report(pg_conn, profiles: list[StorageProfile], rows, num_queries, k, ef_search):
+    """
+    Recall is measured against exact search over full size float32 embeddings
+    """
+    reference = parse_storage_profile("768-float32")
+    with pg_conn.cursor() as cur:
+        queries = sample_queries(cur, rows, num_queries)
+        reference_result = build_profile_table(cur, reference, rows)
+        set_search_params(cur, exact=True)
+        truth, _ = knn(cur, reference, queries, k)
+
+        set_search_params(cur, ef_search=ef_search)
+        results = {}
+        for profile in profiles:
+            if profile == reference:
+                result = dict(reference_result)
+            else:
+                result = build_profile_table(cur, profile, rows)
+            found, latencies = knn(cur, profile, queries, k)
+            result.update(
+                {
+                    f"recall@{k}": recall_at_k(found, truth),
+                    **latency_stats(latencies),
+                }
+            )
+            results[profile_name(profile)] = result
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares table/index size and kNN latency/recall "
+        "of embedding storage profiles"
+    )
+    parser.add_argument(
+        "--profiles",
+        type=lambda value: [parse_storage_profile(p) for p in value.split(",")],
+        default=PROFILES,
+        help=f"comma separated <dims>-<float32|float16>, default {PROFILES}",
+    )
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, default=40)
+    parser.add_argument("--keep", action="store_true", help="keep profile tables")
+    args = parser.parse_args()
+
+    load_dotenv()
+    pg_conn = open_pg_conn()
+    pg_conn.autocommit = True
+    results = report(
+        pg_conn, args.profiles, args.rows, args.queries, args.k, args.ef_search
+    )
+    for name, result in results.items():
+        print(
+            f"{name}: "
+            + ", ".join(f"{key} {value:.3f}" for key, value in result.items())
+        )
+
+    if not args.keep:
+        with pg_conn.cursor() as cur:
+            for name in {*map(profile_name, args.profiles), "768-float32"}:
+                table = profile_table(parse_storage_profile(name))
+                cur.execute(f"DROP TABLE IF EXISTS {table}")
+    pg_conn.close()
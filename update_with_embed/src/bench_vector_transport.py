@@ -0,0 +1,106 @@
+import argparse
+import io
+import os
+import time
+import uuid
+
+import numpy as np
+import psycopg2 as pg2
+from dotenv import load_dotenv
+
+from utils.vector_codec import encode_idx_embed_copy, encode_vector
+
+
+DIM = 768
+
+
+def bench_encode(embeds: np.ndarray, repeat: int) -> dict[str, tuple[float, int]]:
+    """
+    returns {method: (best seconds, payload bytes)} for encoding all embeds
+    """
+    methods = {
+        "text": lambda embed: str(embed.tolist()).encode("utf-8"),
+        "binary": encode_vector,
+    }
+    results = {}
+    for name, encode in methods.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            payload = [encode(embed) for embed in embeds]
+            best = min(best, time.perf_counter() - start)
+        results[name] = (best, sum(len(item) for item in payload))
+    return results
+
+
+def bench_copy(pg_conn, embeds: np.ndarray, repeat: int) -> dict[str, float]:
+    """
+    returns {method: best seconds} for COPY of (idx, embed) rows into temp table,
+    including client side encoding
+    """
+    items = [(str(uuid.uuid4()), embed) for embed in embeds]
+    with pg_conn.cursor() as cur:
+        cur.execute(
+            f"""
+                CREATE TEMP TABLE IF NOT EXISTS vector_transport (
+                    idx     UUID,
+                    embed   vector({DIM})
+                )
+            """
+        )
+
+        def copy_text():
+            buffer = io.StringIO(
+                "".join(f"{idx}\t{str(embed.tolist())}\n" for idx, embed in items)
+            )
+            cur.copy_expert("COPY vector_transport FROM STDIN", buffer)
+
+        def copy_binary():
+            buffer = io.BytesIO(encode_idx_embed_copy(items))
+            cur.copy_expert(
+                "COPY vector_transport FROM STDIN WITH (FORMAT binary)", buffer
+            )
+
+        results = {}
+        for name, copy in {"text": copy_text, "binary": copy_binary}.items():
+            best = float("inf")
+            for _ in range(repeat):
+                cur.execute("TRUNCATE vector_transport")
+                start = time.perf_counter()
+                copy()
+                best = min(best, time.perf_counter() - start)
+            results[name] = best
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares text and binary transfer of 768 dim vectors"
+    )
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", action="store_true", help="also COPY into postgres")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeds = rng.standard_normal((args.rows, DIM), dtype=np.float32)
+
+    for name, (seconds, size) in bench_encode(embeds, args.repeat).items():
+        print(
+            f"encode {name}: {args.rows / seconds:.0f} vectors/s, "
+            f"{size / args.rows:.0f} B/vector"
+        )
+
+    if args.db:
+        load_dotenv()
+        pg_conn = pg2.connect(
+            host="localhost",
+            port=os.environ["PG_PORT"],
+            database="pgvector-test",
+            user=os.environ["PG_USER"],
+            password=os.environ["PG_PASSWORD"],
+        )
+        pg_conn.autocommit = True
+        for name, seconds in bench_copy(pg_conn, embeds, args.repeat).items():
+            print(f"copy {name}: {args.rows / seconds:.0f} rows/s")
+        pg_conn.close()
@@ -0,0 +1,10 @@
+"""
+Preloaded by the forkserver of EmbedSocketPool, the model is loaded once there
+and every forked embedding worker shares its weights copy-on-write.
+ONNX Runtime sessions own threads, which do not survive fork, so ONNX backends
+are loaded by every worker instead.
+"""
+from utils.local_encoder import embed_backend, get_model
+
+if embed_backend() == "torch":
+    get_model()
@@ -0,0 +1,76 @@
+import argparse
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.db_utils import open_pg_conn, sample_texts
+from utils.local_encoder import (
+    BACKENDS,
+    QUANT_CONFIG,
+    encode_bucketed,
+    export_onnx,
+    get_model,
+)
+
+
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return np.sum(a * b, axis=1)
+
+
+def check_accuracy(texts: list[str], backends: list[str]) -> dict[str, dict]:
+    """
+    returns {backend: cosine similarity stats against torch and embeddings/s},
+    every text is compared with its own torch embedding
+    """
+    results = {}
+    reference = None
+    for backend in ["torch", *[b for b in backends if b != "torch"]]:
+        model = get_model(backend)
+        start = time.perf_counter()
+        embeds = encode_bucketed(model, texts)
+        seconds = time.perf_counter() - start
+        if reference is None:
+            reference = embeds
+        cosine = cosine_rows(reference, embeds)
+        results[backend] = {
+            "embeddings_per_s": len(texts) / seconds,
+            "mean_cosine": float(cosine.mean()),
+            "p1_cosine": float(np.percentile(cosine, 1)),
+            "min_cosine": float(cosine.min()),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Exports the local model to ONNX and int8 ONNX, "
+        "compares their embeddings with torch ones on sampled comments"
+    )
+    parser.add_argument("--skip-export", action="store_true")
+    parser.add_argument("--rows", type=int, default=1_000, help="0 skips the check")
+    parser.add_argument(
+        "--backends",
+        type=lambda value: value.split(","),
+        default=list(BACKENDS),
+        help=f"comma separated subset of: {', '.join(BACKENDS)}",
+    )
+    args = parser.parse_args()
+
+    if not args.skip_export:
+        export_onnx(QUANT_CONFIG)
+
+    if args.rows > 0:
+        load_dotenv()
+        pg_conn = open_pg_conn()
+        texts = sample_texts(pg_conn, args.rows)
+        pg_conn.close()
+
+        for backend, result in check_accuracy(texts, args.backends).items():
+            print(
+                f"{backend}: {result['embeddings_per_s']:.1f} embeddings/s, "
+                f"cosine vs torch mean {result['mean_cosine']:.5f}, "
+                f"p1 {result['p1_cosine']:.5f}, min {result['min_cosine']:.5f}"
+            )
@@ -0,0 +1,91 @@
+import argparse
+
+from dotenv import load_dotenv
+
+from utils.bulk_update import (
+    ADD_TEXT_HASH_SQL,
+    EMBED_COLUMN_SQL,
+    alter_embed_column_sql,
+)
+from utils.db_utils import open_pg_conn
+from utils.search import drop_vector_indexes, vector_indexes
+from utils.storage_profile import (
+    StorageProfile,
+    column_type,
+    parse_storage_profile,
+    profile_name,
+    storage_profile,
+)
+
+
+def migrate_storage(
+    pg_conn, profile: StorageProfile, force: bool = False, drop_indexes: bool = False
+):
+    """
+    params:
+    pg_conn: psycopg2 connection, not in autocommit mode
+    profile: StorageProfile, target type of the embed column
+    force: bool, allow widening the column, which clears every stored embedding
+    drop_indexes: bool, drop ANN indexes on embed, their operator class belongs
+                  to the old type, rebuild them by search.build_index afterwards
+
+    Changes the embed column in one transaction, the ALTER rewrites the table
+    under an ACCESS EXCLUSIVE lock. Also adds text_sha256 to tables created
+    before it was part of the schema.
+    """
+    with pg_conn.cursor() as cur:
+        cur.execute(ADD_TEXT_HASH_SQL)
+        cur.execute(EMBED_COLUMN_SQL)
+        current, current_dims = cur.fetchone()
+        statement, clears = alter_embed_column_sql(current, current_dims, profile)
+        if statement is None:
+            print(f"embed column is {current} already")
+            pg_conn.commit()
+            return
+        if clears and not force:
+            raise ValueError(
+                f"{current} -> {column_type(profile)} clears every stored "
+                "embedding, rerun with --force to embed them again"
+            )
+        if indexes := vector_indexes(cur):
+            if not drop_indexes:
+                raise ValueError(
+                    f"ANN indexes {', '.join(indexes)} use the {current} operator "
+                    "class, rerun with --drop-indexes"
+                )
+            drop_vector_indexes(cur)
+        cur.execute(statement)
+    pg_conn.commit()
+    print(f"embed column {current} -> {column_type(profile)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Changes the embed column to a storage profile, embeddings "
+        "are truncated in place, or cleared when the column gets wider"
+    )
+    parser.add_argument(
+        "--profile",
+        type=parse_storage_profile,
+        default=None,
+        help="<dims>-<float32|float16>, default EMBED_STORAGE env",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="allow clearing stored embeddings"
+    )
+    parser.add_argument(
+        "--drop-indexes", action="store_true", help="drop ANN indexes on embed"
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    profile = args.profile or storage_profile()
+    pg_conn = open_pg_conn()
+    try:
+        print(f"migrating to {profile_name(profile)}")
+        migrate_storage(pg_conn, profile, args.force, args.drop_indexes)
+    except Exception:
+        pg_conn.rollback()
+        raise
+    finally:
+        pg_conn.close()
@@ -1,14 +1,17 @@
+import argparse
 import os
-import pandas as pd
 import time
 import sys
 import socket
-import json
 import multiprocessing
+from functools import partial
 
 from dotenv import load_dotenv
 
-from utils.db_utils import open_sqlalchemy_conn
+from utils.backfill import backfill, parse_backfill_args
+from utils.db_utils import open_pg_conn, open_sqlalchemy_conn, sample_texts
+from utils.framing import FrameReader, send_json_frame
+from utils.layout import autotune_layout, cpu_sets, parse_layout
 from pg_embed_server import launch_server
 from utils.measure_utils import measure
 
@@ -16,30 +19,115 @@ from utils.measure_utils import measure
 NUM_PARALLEL_WORKERS = 4
 LIMIT = 1
 CHUNK_SIZE = 10_000
+CHECKPOINT_PATH = "/tmp/pg_client_feed.checkpoint"
+READY_TIMEOUT_S = 300
 
 
 class EmbedSocketPool:
-    def __init__(self, num_workers=1):
-        self.uds_paths = []
+    def __init__(
+        self,
+        num_workers=1,
+        threads_per_worker: int | None = None,
+        backend: str | None = None,
+    ):
+        """
+        num_workers x threads_per_worker is the layout, every worker is pinned
+        to its own cpu set of threads_per_worker cpus, without it workers share
+        all cpus
+        """
+        self.uds_paths = [f"/tmp/uds_{i}.socket" for i in range(num_workers)]
         self.processes = []
+        self.sockets = []
+        self.readers = []
         self.num_workers = num_workers
-        self.mp_context = multiprocessing.get_context("spawn")
-        self._create_uds_files()
-
-    def _create_uds_files(self):
-        for i in range(self.num_workers):
-            if not os.path.exists(f"/tmp/uds_{i}.socket"):
-                os.mknod(f"/tmp/uds_{i}.socket")
-            self.uds_paths.append(f"/tmp/uds_{i}.socket")
+        if backend is not None:
+            # inherited by the forkserver, which preloads this backend
+            os.environ["EMBED_BACKEND"] = backend
+        # workers are forked from a server which already holds the model,
+        # so its weights are loaded once and shared copy-on-write
+        self.mp_context = multiprocessing.get_context("forkserver")
+        self.mp_context.set_forkserver_preload(["embed_model_preload"])
+        self.cpu_sets = (
+            cpu_sets(num_workers, threads_per_worker)
+            if threads_per_worker
+            else [None] * num_workers
+        )
 
     def spawn_servers(self):
         for i in range(self.num_workers):
             p = self.mp_context.Process(
-                target=launch_server, args=[f"/tmp/uds_{i}.socket"]
+                target=launch_server,
+                args=[self.uds_paths[i]],
+                kwargs={"cpus": self.cpu_sets[i]},
             )
             p.start()
             self.processes.append(p)
 
+    def connect(self, timeout: float = READY_TIMEOUT_S):
+        """
+        Opens one long-lived connection per worker and waits for its ready
+        frame, sent once the worker has loaded the model and connected to
+        Postgres
+        """
+        deadline = time.monotonic() + timeout
+        for i, uds_path in enumerate(self.uds_paths):
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            while True:
+                try:
+                    s.connect(uds_path)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    # socket not bound yet, or stale file of previous run
+                    if time.monotonic() > deadline:
+                        s.close()
+                        raise TimeoutError(f"worker {i} not listening on {uds_path}")
+                    time.sleep(0.05)
+            # settimeout(0.0) would make the socket non-blocking, its recv
+            # raising BlockingIOError instead of waiting
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                s.close()
+                raise TimeoutError(f"worker {i} not ready in {timeout} s")
+            s.settimeout(remaining)
+            reader = FrameReader(s)
+            try:
+                ready = reader.read_json_frame()
+            except socket.timeout:
+                s.close()
+                raise TimeoutError(f"worker {i} not ready in {timeout} s")
+            s.settimeout(None)
+            if not ready or not ready.get("ready"):
+                raise ConnectionError(f"worker {i} closed connection before ready")
+            print(
+                f"worker {i} ready: pid {ready['pid']}, {ready['backend']}, "
+                f"cpus {ready['cpus']}, "
+                f"startup {ready['startup_s']:.2f} s, "
+                + ", ".join(
+                    f"{key} {value:.0f}"
+                    for key, value in ready.items()
+                    if key.endswith("_mb")
+                )
+            )
+            self.sockets.append(s)
+            self.readers.append(reader)
+
+    def send_batch(self, worker: int, rows: list[dict]):
+        send_json_frame(self.sockets[worker], rows)
+
+    def wait_ack(self, worker: int) -> int:
+        ack = self.readers[worker].read_json_frame()
+        if ack is None:
+            raise ConnectionError(f"worker {worker} closed connection")
+        if "error" in ack:
+            raise RuntimeError(f"worker {worker} failed to write: {ack['error']}")
+        return ack["rows"]
+
+    def close(self):
+        for s in self.sockets:
+            s.close()
+        self.sockets = []
+        self.readers = []
+
     def __str__(self):
         s = ""
         for p in self.processes:
@@ -47,45 +135,94 @@ class EmbedSocketPool:
         return s
 
 
-def send_chunks_to_sockets(uds_pool, bulk):
-    for i in range(0, len(bulk), NUM_PARALLEL_WORKERS):
-        for j in range(NUM_PARALLEL_WORKERS):
-            try:
-                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                # make sure server is listening!
-                s.connect(uds_pool.uds_paths[j])
-                s.sendall(json.dumps(bulk[i + j]).encode("utf-8"))
-                s.close()
-            except Exception:
-                break
+def send_chunks_to_sockets(uds_pool, bulk) -> int:
+    """
+    Splits bulk into one frame per worker, sends all frames before waiting
+    for acknowledgements, so workers embed in parallel
+
+    returns number of rows written back by the workers
+    """
+    batches = [bulk[j :: uds_pool.num_workers] for j in range(uds_pool.num_workers)]
+    for j, batch in enumerate(batches):
+        uds_pool.send_batch(j, batch)
+    written = 0
+    for j, batch in enumerate(batches):
+        acked = uds_pool.wait_ack(j)
+        if acked != len(batch):
+            raise RuntimeError(f"worker {j} acked {acked} of {len(batch)} rows")
+        written += acked
+    return written
 
 
 @measure
-def iterate_and_update(iterator_conn, uds_pool, limit=LIMIT):
-    cnt = 0
-    with iterator_conn.connect() as conn:
-        for df in pd.read_sql(
-            "SELECT idx::text, text FROM youtube_comments",
-            conn,
-            chunksize=CHUNK_SIZE,
-        ):
-            if cnt == limit:
-                return True
-            else:
-                cnt += 1
-                bulk = df.to_dict(orient="records")
-                send_chunks_to_sockets(uds_pool, bulk)
+def iterate_and_update(
+    iterator_conn,
+    uds_pool,
+    limit=LIMIT,
+    shard=0,
+    num_shards=1,
+    checkpoint_path=None,
+):
+    read_conn = iterator_conn.raw_connection()
+    try:
+        backfill(
+            read_conn,
+            partial(send_chunks_to_sockets, uds_pool),
+            chunk_size=CHUNK_SIZE,
+            shard=shard,
+            num_shards=num_shards,
+            checkpoint_path=checkpoint_path,
+            limit=limit,
+        )
+    finally:
+        read_conn.close()
+    return True
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--layout",
+        type=parse_layout,
+        default=None,
+        help='workers x threads, e.g. "4x2", default '
+        f"{NUM_PARALLEL_WORKERS} workers on shared cpus",
+    )
+    parser.add_argument(
+        "--autotune",
+        type=int,
+        default=0,
+        metavar="ROWS",
+        help="benchmark all layouts on ROWS sampled comments, use the fastest",
+    )
+    args = parse_backfill_args(CHECKPOINT_PATH, parser)
     load_dotenv()
     iterator_conn = open_sqlalchemy_conn()
 
-    uds_pool = EmbedSocketPool(NUM_PARALLEL_WORKERS)
+    num_workers, threads = args.layout or (NUM_PARALLEL_WORKERS, None)
+    if args.autotune > 0:
+        pg_conn = open_pg_conn()
+        texts = sample_texts(pg_conn, args.autotune)
+        pg_conn.close()
+        num_workers, threads = autotune_layout(
+            multiprocessing.get_context("spawn"), texts
+        )
+        print(f"autotuned layout: {num_workers}x{threads}")
+
+    uds_pool = EmbedSocketPool(num_workers, threads)
     uds_pool.spawn_servers()
     print(uds_pool)
 
+    uds_pool.connect()
     print("Servers running.")
-    time.sleep(5)
-    if iterate_and_update(iterator_conn, uds_pool):
-        sys.exit(0)
+    try:
+        if iterate_and_update(
+            iterator_conn,
+            uds_pool,
+            shard=args.shard,
+            num_shards=args.num_shards,
+            checkpoint_path=args.checkpoint,
+        ):
+            sys.exit(0)
+    finally:
+        uds_pool.close()
@@ -1,35 +1,29 @@
 import os
+import select
 import socket
-import json
 import sys
+import time
+from functools import partial
 import psycopg2 as pg2
-import torch
 
 from dotenv import load_dotenv
 
-from sentence_transformers import SentenceTransformer
-
-# torch.set_num_threads(4)
-
-local_embed_model = SentenceTransformer(
-    "/home/stephenx/LLMs/ollama/third-party/safetensors/nomic-embed-text-v1.5",
-    # device="cpu",
-    trust_remote_code=True,
+from utils.bulk_update import bulk_update_embeddings, text_sha256
+from utils.embed_cache import EmbedCache, embed_with_cache
+from utils.framing import FrameReader, send_json_frame
+from utils.local_encoder import (
+    MAX_SEQ_LENGTH,
+    embed_backend,
+    encode_bucketed,
+    get_model,
+    model_name,
+    pin_to_cpus,
 )
+from utils.measure_utils import memory_usage_mb
+from utils.storage_profile import storage_profile, truncate_embeds
 
-
-def update_pg_with_embed(pg_conn, row_json: dict[str:str], embed: list[float]):
-    cur = pg_conn.cursor()
-    try:
-        cur.execute(
-            """
-                UPDATE youtube_comments SET embed = %s WHERE idx = %s
-            """,
-            (embed, row_json.get("idx")),
-        )
-        pg_conn.commit()
-    except Exception as e:
-        print(f"in update_pg_with_embed: {e}")
+MAX_BATCH_SIZE = 64
+MAX_WAIT_MS = 20
 
 
 def prepare_server_socket(socket_path):
@@ -51,8 +45,140 @@ def prepare_server_socket(socket_path):
         sys.exit(-1)
 
 
-def launch_server(socket_path):
+def encode_texts(texts: list[str], max_batch_size: int = MAX_BATCH_SIZE):
+    return encode_bucketed(get_model(), texts, max_batch_size)
+
+
+def embed_and_update(
+    pg_conn,
+    rows: list[dict],
+    cache: EmbedCache | None = None,
+    max_batch_size: int = MAX_BATCH_SIZE,
+) -> int:
+    """
+    Embeds all pending rows, which are neither cached nor duplicates, by single
+    encode_bucketed call, which sorts them by token length before cutting
+    batches of at most `max_batch_size`, embeddings are written back to their
+    rows by one staged bulk UPDATE
+
+    returns number of rows written back
+    """
+    # cache holds full size embeddings, truncated to the storage profile here
+    texts = [row.get("text", "") for row in rows]
+    embeds = truncate_embeds(
+        embed_with_cache(
+            texts, partial(encode_texts, max_batch_size=max_batch_size), cache
+        ),
+        storage_profile(),
+    )
+    return bulk_update_embeddings(
+        pg_conn,
+        [
+            (row.get("idx"), embed, text_sha256(text))
+            for row, text, embed in zip(rows, texts, embeds)
+        ],
+    )
+
+
+def try_embed_and_update(
+    pg_conn,
+    rows: list[dict],
+    cache: EmbedCache | None = None,
+    max_batch_size: int = MAX_BATCH_SIZE,
+) -> tuple[int, str | None]:
+    """
+    returns number of rows written back and error of a failed write, if any
+    """
+    try:
+        return embed_and_update(pg_conn, rows, cache, max_batch_size), None
+    except Exception as e:
+        print(f"in embed_and_update: {e}")
+        if not pg_conn.autocommit:
+            pg_conn.rollback()
+        return 0, repr(e)
+
+
+def ack_frames(socket_conn, unacked: list[int], written: int, error: str | None):
+    """
+    Acknowledges frames in arrival order, each with at most its own number
+    of rows out of `written`, so the client sees a short ack for rows which
+    were not written back. A failed write is reported in every ack.
+    """
+    for rows in unacked:
+        ack = {"rows": min(rows, written)}
+        written -= ack["rows"]
+        if error is not None:
+            ack["error"] = error
+        send_json_frame(socket_conn, ack)
+
+
+def serve_connection(
+    socket_conn,
+    pg_conn,
+    max_batch_size: int = MAX_BATCH_SIZE,
+    max_wait_ms: int = MAX_WAIT_MS,
+    cache: EmbedCache | None = None,
+):
+    """
+    Every frame from the client holds a batch of rows. Once at least
+    `max_batch_size` rows are pending, all of them are embedded together, so
+    they are bucketed by token length across the whole frame, not in arrival
+    order. Fewer rows wait `max_wait_ms` for rows of the next frame. Frames
+    are acknowledged once all their rows are processed, with the number of
+    rows actually written back.
+    """
+    reader = FrameReader(socket_conn)
+    pending = []
+    unacked = []
+    written = 0
+    error = None
+    while True:
+        if pending:
+            ready, _, _ = select.select([socket_conn], [], [], max_wait_ms / 1000)
+            if not ready:
+                n, e = try_embed_and_update(pg_conn, pending, cache, max_batch_size)
+                written, error = written + n, error or e
+                pending = []
+        if not pending:
+            ack_frames(socket_conn, unacked, written, error)
+            unacked, written, error = [], 0, None
+        rows = reader.read_json_frame()
+        if rows is None:
+            break
+        pending.extend(rows)
+        unacked.append(len(rows))
+        if len(pending) >= max_batch_size:
+            n, e = try_embed_and_update(pg_conn, pending, cache, max_batch_size)
+            written, error = written + n, error or e
+            pending = []
+
+    if pending:
+        try_embed_and_update(pg_conn, pending, cache, max_batch_size)
+
+
+def launch_server(
+    socket_path,
+    max_batch_size: int = MAX_BATCH_SIZE,
+    max_wait_ms: int = MAX_WAIT_MS,
+    max_seq_length: int = MAX_SEQ_LENGTH,
+    cpus: list[int] | None = None,
+):
+    """
+    Binds the socket first, so clients can connect while the model loads,
+    every accepted connection first receives a ready frame with pid,
+    startup time and memory usage of this worker. The model backend is
+    taken from EMBED_BACKEND env (torch, onnx, onnx-int8).
+
+    cpus: list[int], worker runs only on these cpus with as many threads
+    """
+    start = time.perf_counter()
     s = prepare_server_socket(socket_path)
+    if cpus:
+        pin_to_cpus(cpus)
+    # no-op when the model was preloaded before fork
+    model = get_model(threads=len(cpus) if cpus else None)
+    # longer texts are truncated, attention cost grows with sequence length
+    model.max_seq_length = max_seq_length
     load_dotenv()
     pg_conn = pg2.connect(
         host="localhost",
@@ -66,22 +192,24 @@ def launch_server(socket_path):
     if not pg_conn.closed:
         print("Postgres connected")
 
+    cache = EmbedCache(model=model_name(embed_backend()))
+    ready = {
+        "ready": True,
+        "pid": os.getpid(),
+        "backend": embed_backend(),
+        "cpus": sorted(os.sched_getaffinity(0)),
+        "startup_s": time.perf_counter() - start,
+        **memory_usage_mb(),
+    }
     while True:
         socket_conn, addr = s.accept()
         # print("Connection by client")
-
-        buffer = ""
-        while True:
-            data = socket_conn.recv(4096)
-            if not data:
-                break
-            else:
-                data_json_str = data.decode("utf-8")
-                buffer += data_json_str
-
         try:
-            data_json = json.loads(buffer)
-            embed = local_embed_model.encode(data_json.get("text", ""))
-            update_pg_with_embed(pg_conn, data_json, embed.tolist())
+            send_json_frame(socket_conn, ready)
+            serve_connection(
+                socket_conn, pg_conn, max_batch_size, max_wait_ms, cache
+            )
         except Exception as e:
             print(f"in connection loop: {e}")
+        finally:
+            socket_conn.close()
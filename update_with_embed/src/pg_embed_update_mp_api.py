@@ -1,17 +1,22 @@
+import argparse
 import asyncio as aio
-import psycopg2 as pg2
-import pandas as pd
 import os
-import time
 import queue
+import time
 
-from multiprocessing import JoinableQueue, Process
-from ollama import AsyncClient
+from multiprocessing import JoinableQueue, Process, Queue
 from dotenv import load_dotenv
 from typing import TypedDict
 
-from update_with_embed.src.utils.db_utils import open_sqlalchemy_conn
-from update_with_embed.src.utils.measure_utils import async_measure, measure
+from update_with_embed.src.utils.backfill import iter_pending_chunks
+from update_with_embed.src.utils.bulk_update import (
+    bulk_update_embeddings,
+    text_sha256,
+)
+from update_with_embed.src.utils.db_utils import open_pg_conn
+from update_with_embed.src.utils.embed_cache import EmbedCache
+from update_with_embed.src.utils.ollama_pool import OLLAMA_CACHE_MODEL, OllamaPool
+from update_with_embed.src.utils.measure_utils import measure
 
 
 class DbItem(TypedDict):
@@ -24,112 +29,166 @@ class DbUpdatedItem(TypedDict):
     embed: list[float]
 
 
-OLLAMA_PORT = 11_434
 LIMIT = 100
 CHUNKSIZE = 100
+POLL_S = 5.0
 
 
-class OllamaSimplePool:
-    def __init__(self):
-        self.client = AsyncClient(host=f"http://localhost:{OLLAMA_PORT}")
+def check_consumers(consumers: list[Process]):
+    """
+    raises once any consumer died before finishing, e.g. crashed or was killed
+    """
+    for consumer in consumers:
+        if consumer.exitcode not in (None, 0):
+            raise RuntimeError(f"{consumer.name} exited with {consumer.exitcode}")
 
-    @async_measure
-    async def embed_chunk(self, chunk: list[DbItem]):
-        responses = await aio.gather(
-            *[self._embed_coro(self.client, item.get("text", "")) for item in chunk]
-        )
-        return responses
 
-    def _embed_coro(self, ollama_aclient: AsyncClient, text: str):
-        return ollama_aclient.embeddings(
-            model="nomic-embed-text",
-            prompt=text,
-        )
-
-
-def pg_get_chunks_producer(q: JoinableQueue, pg_iterator_conn):
-    cnt = 0
-    with pg_iterator_conn.connect() as conn:
-        for df in pd.read_sql(
-            "SELECT idx, text FROM youtube_comments", conn, chunksize=CHUNKSIZE
-        ):
-            if cnt == LIMIT:
+def put_while_consumers_alive(q: JoinableQueue, item, consumers: list[Process]):
+    # a plain put blocks forever on a full queue nobody reads anymore
+    while True:
+        try:
+            q.put(item, timeout=POLL_S)
+            return
+        except queue.Full:
+            check_consumers(consumers)
+
+
+def pg_get_chunks_producer(q: JoinableQueue, consumers: list[Process], limit: int):
+    """
+    Puts pending chunks into bounded `q`, so reading waits while all consumers
+    are busy, then one sentinel per consumer
+    """
+    pg_conn = open_pg_conn()
+    try:
+        for cnt, chunk in enumerate(iter_pending_chunks(pg_conn, chunk_size=CHUNKSIZE)):
+            if cnt == limit:
                 break
-            else:
-                cnt += 1
-                chunk = df.to_dict(orient="records")
-                time.sleep(1)
-                q.put(chunk)
+            put_while_consumers_alive(q, chunk, consumers)
+    finally:
+        pg_conn.close()
+    for _ in consumers:
+        put_while_consumers_alive(q, None, consumers)
 
     print("all fetched from db")
-    q.join()
 
 
-def pg_embed_update_consumer(q: JoinableQueue, ollama_pool, pg_conn):
-    aio.run(main_consumer_loop(q, ollama_pool, pg_conn))
+def pg_embed_update_consumer(q: JoinableQueue, stats_q: Queue, consumer_id: int):
+    """
+    Every consumer opens its own Postgres connection and Ollama client,
+    nothing connection-like crosses the process boundary
+    """
+    load_dotenv()
+    pg_conn = open_pg_conn()
+    ollama_pool = OllamaPool(cache=EmbedCache(model=OLLAMA_CACHE_MODEL))
+    stats = {
+        "consumer": consumer_id,
+        "chunks": 0,
+        "rows": 0,
+        "failed_rows": 0,
+        "busy_s": 0.0,
+    }
+    try:
+        aio.run(main_consumer_loop(q, ollama_pool, pg_conn, stats))
+    finally:
+        pg_conn.close()
+        stats_q.put(stats)
 
 
-async def main_consumer_loop(q: JoinableQueue, ollama_pool, pg_conn):
+async def main_consumer_loop(q: JoinableQueue, ollama_pool, pg_conn, stats: dict):
     while True:
+        chunk = q.get()
         try:
-            chunk = q.get()
-            responses = await ollama_pool.embed_chunk(chunk=chunk)
-            seq_update_pg_with_embed(pg_conn, chunk, responses)
+            if chunk is None:
+                break
+            start = time.perf_counter()
+            embeds = await ollama_pool.embed_bulk(bulk=chunk)
+            written = seq_update_pg_with_embed(pg_conn, chunk, embeds)
+            stats["busy_s"] += time.perf_counter() - start
+            stats["chunks"] += 1
+            stats["rows"] += written
+            stats["failed_rows"] += len(chunk) - written
+        except Exception as e:
+            # failed chunk stays pending for the next run, consumer keeps going
+            print(e)
+            pg_conn.rollback()
+            stats["failed_rows"] += len(chunk)
+        finally:
             q.task_done()
-        except queue.Empty:
-            print("q is empty")
-            break
 
 
 def seq_update_pg_with_embed(
-    pg_conn, chunk: list[dict[str:str]], responses: list[float]
-):
+    pg_conn, chunk: list[dict[str:str]], embeds: list[list[float]]
+) -> int:
     updated_data = [
-        (str(response.embedding), str(chunk.get("idx")))
-        for chunk, response in zip(chunk, responses)
+        (str(chunk.get("idx")), embed, text_sha256(chunk.get("text", "")))
+        for chunk, embed in zip(chunk, embeds)
     ]
-    cur = pg_conn.cursor()
-    try:
-        cur.executemany(
-            """
-                UPDATE youtube_comments SET embed = %s WHERE idx = %s
-            """,
-            updated_data,
-        )
-        pg_conn.commit()
-    except Exception as e:
-        print(e)
-        pg_conn.rollback()
-
+    return bulk_update_embeddings(pg_conn, updated_data)
 
-@measure
-def main(q: JoinableQueue, ollama_pool, pg_conn, pg_iterator_conn):
-    p_producer = Process(target=pg_get_chunks_producer, args=[q, pg_iterator_conn])
-    p_consumer = Process(
-        target=pg_embed_update_consumer, args=[q, ollama_pool, pg_conn], daemon=True
-    )
 
-    p_consumer.start()
-    p_producer.start()
+def collect_stats(stats_q: Queue, consumers: list[Process]) -> list[dict]:
+    """
+    Waits for stats of every consumer, sent once it processed its sentinel,
+    raises instead of waiting forever when a consumer died without them
+    """
+    stats = []
+    while len(stats) < len(consumers):
+        try:
+            stats.append(stats_q.get(timeout=POLL_S))
+        except queue.Empty:
+            check_consumers(consumers)
+    return stats
 
-    p_producer.join()
 
+@measure
+def main(num_consumers: int, limit: int = LIMIT, queue_size: int = -1):
+    """
+    params:
+    num_consumers: int, embedding processes
+    limit: int, max number of chunks, limit < 0 means until no row is left
+    queue_size: int, max chunks waiting for consumers, < 0 means 2 per consumer
+    """
+    q = JoinableQueue(maxsize=queue_size if queue_size > 0 else 2 * num_consumers)
+    stats_q = Queue()
+    consumers = [
+        Process(target=pg_embed_update_consumer, args=[q, stats_q, i])
+        for i in range(num_consumers)
+    ]
+    for consumer in consumers:
+        consumer.start()
 
-if __name__ == "__main__":
-    q = JoinableQueue()
-    load_dotenv()
-    ollama_pool = OllamaSimplePool()
-    pg_conn = pg2.connect(
-        host="localhost",
-        port=os.environ["PG_PORT"],
-        database="pgvector-test",
-        user=os.environ["PG_USER"],
-        password=os.environ["PG_PASSWORD"],
+    start = time.perf_counter()
+    try:
+        pg_get_chunks_producer(q, consumers, limit)
+        stats = collect_stats(stats_q, consumers)
+    except Exception:
+        for consumer in consumers:
+            consumer.terminate()
+        raise
+    finally:
+        for consumer in consumers:
+            consumer.join()
+    seconds = time.perf_counter() - start
+
+    for s in sorted(stats, key=lambda s: s["consumer"]):
+        print(
+            f"consumer {s['consumer']}: {s['chunks']} chunks, {s['rows']} rows, "
+            f"{s['failed_rows']} failed, "
+            f"{s['rows'] / seconds:.1f} rows/s, busy {s['busy_s']:.2f}/{seconds:.2f} s"
+        )
+    total_rows = sum(s["rows"] for s in stats)
+    failed_rows = sum(s["failed_rows"] for s in stats)
+    print(
+        f"total: {total_rows} rows, {total_rows / seconds:.1f} rows/s, "
+        f"{failed_rows} failed rows left pending"
     )
-    pg_iterator_conn = open_sqlalchemy_conn()
 
-    main(q, ollama_pool, pg_conn, pg_iterator_conn)
 
-    pg_conn.close()
-    if pg_conn.closed:
-        print("PG conn closed")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--consumers", type=int, default=os.cpu_count())
+    parser.add_argument("--limit", type=int, default=LIMIT)
+    parser.add_argument("--queue-size", type=int, default=-1)
+    args = parser.parse_args()
+    load_dotenv()
+    main(args.consumers, args.limit, args.queue_size)
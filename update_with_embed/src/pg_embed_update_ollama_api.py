@@ -1,16 +1,23 @@
 import asyncio as aio
-import asyncpg as apg
-import psycopg2 as pg2
-import pandas as pd
-import os
-import time
 
-from ollama import AsyncClient
 from dotenv import load_dotenv
 from typing import TypedDict
 
-from update_with_embed.src.utils.db_utils import open_sqlalchemy_conn
-from update_with_embed.src.utils.measure_utils import async_measure, measure
+from update_with_embed.src.utils.bulk_update import (
+    abulk_update_embeddings,
+    text_sha256,
+)
+from update_with_embed.src.utils.backfill import (
+    aiter_pending_chunks,
+    clear_checkpoint,
+    load_checkpoint,
+    parse_backfill_args,
+    save_checkpoint,
+)
+from update_with_embed.src.utils.db_utils import open_asyncpg_pool
+from update_with_embed.src.utils.embed_cache import EmbedCache
+from update_with_embed.src.utils.ollama_pool import OLLAMA_CACHE_MODEL, OllamaPool
+from update_with_embed.src.utils.measure_utils import StageStats, async_measure
 
 
 class DbItem(TypedDict):
@@ -23,97 +30,150 @@ class DbUpdatedItem(TypedDict):
     embed: list[float]
 
 
-OLLAMA_PORT = 11_434
-
-
-class OllamaSimplePool:
-    def __init__(self):
-        self.client = AsyncClient(host=f"http://localhost:{OLLAMA_PORT}")
-
-    @async_measure
-    async def embed_bulk(self, bulk: list[DbItem]):
-        responses = await aio.gather(
-            *[self._embed_coro(self.client, item.get("text", "")) for item in bulk]
-        )
-        return responses
-
-    def _embed_coro(self, ollama_aclient: AsyncClient, text: str):
-        return ollama_aclient.embeddings(
-            model="nomic-embed-text",
-            prompt=text,
-        )
+CHUNKSIZE = 100
+QUEUE_SIZE = 2
+CHECKPOINT_PATH = "/tmp/pg_embed_update_ollama_api.checkpoint"
 
 
 @async_measure
 async def update_pg_with_embed(
-    apg_conn_pool, bulk: dict[str:str], responses: list[float]
-):
+    apg_conn_pool, bulk: list[DbItem], embeds: list[list[float]]
+) -> int:
     updated_data = [
-        (str(response.embedding), str(bulk.get("idx")))
-        for bulk, response in zip(bulk, responses)
+        (str(item.get("idx")), embed, text_sha256(item.get("text", "")))
+        for item, embed in zip(bulk, embeds)
     ]
-
-    apg_conn = await apg_conn_pool.acquire()
-
-    try:
-        await apg_conn.executemany(
-            """
-                UPDATE youtube_comments SET embed = $1 WHERE idx = $2
-            """,
-            updated_data,
+    async with apg_conn_pool.acquire() as apg_conn:
+        return await abulk_update_embeddings(apg_conn, updated_data)
+
+
+async def fetch_stage(
+    apg_conn_pool,
+    out_q: aio.Queue,
+    stats: StageStats,
+    limit: int,
+    shard: int,
+    num_shards: int,
+    after: str | None,
+) -> bool:
+    """
+    returns whether every pending row was fetched, not stopped by `limit`
+    """
+    exhausted = False
+    async with apg_conn_pool.acquire() as apg_conn:
+        chunks = aiter_pending_chunks(
+            apg_conn,
+            chunk_size=CHUNKSIZE,
+            shard=shard,
+            num_shards=num_shards,
+            after=after,
         )
-    except Exception as e:
-        print(e)
-    finally:
-        await apg_conn_pool.release(apg_conn)
+        while stats.items != limit:
+            with stats.busy_with():
+                bulk = await anext(chunks, None)
+            if bulk is None:
+                exhausted = True
+                break
+            await out_q.put(bulk)
+    await out_q.put(None)
+    return exhausted
 
 
-@measure
-def seq_update_pg_with_embed(pg_conn, bulk: dict[str:str], responses: list[float]):
-    updated_data = [
-        (str(response.embedding), str(bulk.get("idx")))
-        for bulk, response in zip(bulk, responses)
-    ]
-    cur = pg_conn.cursor()
-    cur.executemany(
-        """
-            UPDATE youtube_comments SET embed = %s WHERE idx = %s
-        """,
-        updated_data,
-    )
-    pg_conn.commit()
+async def embed_stage(
+    ollamaPool: OllamaPool, in_q: aio.Queue, out_q: aio.Queue, stats: StageStats
+):
+    while (bulk := await in_q.get()) is not None:
+        with stats.busy_with():
+            embeds = await ollamaPool.embed_bulk(bulk=bulk)
+        await out_q.put((bulk, embeds))
+    await out_q.put(None)
+
+
+async def write_stage(
+    apg_conn_pool, in_q: aio.Queue, stats: StageStats, checkpoint_path: str | None
+) -> bool:
+    """
+    returns whether every chunk was written completely
+    """
+    # chunks arrive in idx order, so the checkpoint advances until first chunk
+    # which failed or was written only partially
+    failed = False
+    while (item := await in_q.get()) is not None:
+        bulk, embeds = item
+        with stats.busy_with():
+            try:
+                updated = await update_pg_with_embed(apg_conn_pool, bulk, embeds)
+            except Exception as e:
+                print(e)
+                failed = True
+                continue
+        if updated != len(bulk):
+            print(f"{updated} of {len(bulk)} rows written after {bulk[0]['idx']}")
+            failed = True
+        if not failed:
+            save_checkpoint(checkpoint_path, bulk[-1]["idx"])
+    return not failed
 
 
 @async_measure
-async def iterate_and_update(iterator_conn, ollamaPool, limit=1):
-    pg_conn = pg2.connect(
-        host="localhost",
-        port=os.environ["PG_PORT"],
-        database="pgvector-test",
-        user=os.environ["PG_USER"],
-        password=os.environ["PG_PASSWORD"],
-    )
-
-    cnt = 0
-    with iterator_conn.connect() as conn:
-        for df in pd.read_sql(
-            "SELECT idx, text FROM youtube_comments", conn, chunksize=100
-        ):
-            s1 = time.perf_counter()
-            if cnt == limit:
-                break
-            else:
-                cnt += 1
-                bulk = df.to_dict(orient="records")
-                responses = await ollamaPool.embed_bulk(bulk=bulk)
-                seq_update_pg_with_embed(pg_conn, bulk, responses)
-                print(f"iteration: {cnt} in {time.perf_counter() - s1}")
-
-    conn.close()
+async def iterate_and_update(
+    apg_conn_pool,
+    ollamaPool: OllamaPool,
+    limit: int = -1,
+    shard: int = 0,
+    num_shards: int = 1,
+    checkpoint_path: str | None = None,
+    queue_size: int = QUEUE_SIZE,
+):
+    """
+    params:
+    apg_conn_pool: asyncpg pool with vector codec, see open_asyncpg_pool
+    limit: int, max number of chunks, limit < 0 means until no row is left
+
+    Fetch, embed and write run as concurrent stages joined by bounded queues,
+    so reading chunk N+1 and writing chunk N-1 overlap with embedding chunk N
+    """
+    embed_q = aio.Queue(maxsize=queue_size)
+    write_q = aio.Queue(maxsize=queue_size)
+    stats = [StageStats("fetch"), StageStats("embed"), StageStats("write")]
+    async with aio.TaskGroup() as tg:
+        fetched = tg.create_task(
+            fetch_stage(
+                apg_conn_pool,
+                embed_q,
+                stats[0],
+                limit,
+                shard,
+                num_shards,
+                load_checkpoint(checkpoint_path),
+            )
+        )
+        tg.create_task(embed_stage(ollamaPool, embed_q, write_q, stats[1]))
+        written = tg.create_task(
+            write_stage(apg_conn_pool, write_q, stats[2], checkpoint_path)
+        )
+    # the next run starts from the beginning, so it also picks up rows added
+    # or changed below the last idx of this pass
+    if fetched.result() and written.result():
+        clear_checkpoint(checkpoint_path)
+    for stage in stats:
+        print(stage.report())
+
+
+async def main(args):
+    ollamaPool = OllamaPool(cache=EmbedCache(model=OLLAMA_CACHE_MODEL))
+    # one connection for fetch, the rest for write
+    async with open_asyncpg_pool(size=2) as apg_conn_pool:
+        await iterate_and_update(
+            apg_conn_pool,
+            ollamaPool,
+            shard=args.shard,
+            num_shards=args.num_shards,
+            checkpoint_path=args.checkpoint,
+        )
 
 
 if __name__ == "__main__":
+    args = parse_backfill_args(CHECKPOINT_PATH)
     load_dotenv()
-    iterator_conn = open_sqlalchemy_conn()
-    ollamaPool = OllamaSimplePool()
-    aio.run(iterate_and_update(iterator_conn, ollamaPool))
+    aio.run(main(args))
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import uuid
+from typing import AsyncIterator, Callable, Iterator
+
+from .bulk_update import (
+    EMBED_TABLE,
+    TEXT_HASH_SQL,
+    acheck_storage_profile,
+    check_storage_profile,
+)
+
+CHUNK_SIZE = 10_000
+PAGES_PER_QUERY = 10
+UUID_SPACE = 1 << 128
+
+
+def shard_bounds(shard: int, num_shards: int) -> tuple[str | None, str | None]:
+    """
+    Splits uuid space into `num_shards` equal idx ranges
+
+    returns (lower inclusive, upper exclusive) bound of the shard, None is unbounded
+    """
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"shard {shard} out of range for {num_shards} shards")
+    lower = UUID_SPACE * shard // num_shards
+    upper = UUID_SPACE * (shard + 1) // num_shards
+    return (
+        str(uuid.UUID(int=lower)) if shard > 0 else None,
+        str(uuid.UUID(int=upper)) if shard < num_shards - 1 else None,
+    )
+
+
+def load_checkpoint(checkpoint_path: str | None) -> str | None:
+    """
+    returns idx of the last row written back by a previous run
+    """
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r") as f:
+        return json.load(f).get("last_idx")
+
+
+def save_checkpoint(checkpoint_path: str | None, last_idx: str):
+    if checkpoint_path is None:
+        return
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"last_idx": last_idx}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def clear_checkpoint(checkpoint_path: str | None):
+    """
+    called once a pass found no pending row left, rows added or changed below
+    the last idx are then picked up by the next run
+    """
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def pending_rows_query(after: str | None, lower: str | None, upper: str | None):
+    # not embedded yet, or text changed since it was embedded
+    conditions = [f"(embed IS NULL OR text_sha256 IS DISTINCT FROM {TEXT_HASH_SQL})"]
+    params = {}
+    if after is not None:
+        conditions.append("idx > %(after)s")
+        params["after"] = after
+    if lower is not None:
+        conditions.append("idx >= %(lower)s")
+        params["lower"] = lower
+    if upper is not None:
+        conditions.append("idx < %(upper)s")
+        params["upper"] = upper
+    query = f"""
+        SELECT idx::text, text FROM {EMBED_TABLE}
+        WHERE {" AND ".join(conditions)}
+        ORDER BY idx
+        LIMIT %(limit)s
+    """
+    return query, params
+
+
+def iter_pending_chunks(
+    pg_conn,
+    chunk_size: int = CHUNK_SIZE,
+    shard: int = 0,
+    num_shards: int = 1,
+    after: str | None = None,
+) -> Iterator[list[dict]]:
+    """
+    params:
+    pg_conn: psycopg2 connection used only for reading
+    chunk_size: int, rows per yielded chunk
+    shard, num_shards: int, only rows of this shard's idx range are read
+    after: str, keyset position to resume from, e.g. from load_checkpoint
+
+    Yields chunks of rows which still need embedding (no embedding or text
+    changed since it was embedded), ordered by idx.
+    Each page of PAGES_PER_QUERY chunks is one keyset query read through
+    a server side (named) cursor, so neither side materializes the table.
+    """
+    lower, upper = shard_bounds(shard, num_shards)
+    check_storage_profile(pg_conn)
+    while True:
+        query, params = pending_rows_query(after, lower, upper)
+        params["limit"] = chunk_size * PAGES_PER_QUERY
+        read = 0
+        with pg_conn.cursor(name=f"backfill_{shard}_of_{num_shards}") as cur:
+            cur.itersize = chunk_size
+            cur.execute(query, params)
+            while rows := cur.fetchmany(chunk_size):
+                read += len(rows)
+                after = rows[-1][0]
+                yield [{"idx": idx, "text": text} for idx, text in rows]
+        pg_conn.rollback()
+        if read < params["limit"]:
+            return
+
+
+async def aiter_pending_chunks(
+    apg_conn,
+    chunk_size: int = CHUNK_SIZE,
+    shard: int = 0,
+    num_shards: int = 1,
+    after: str | None = None,
+) -> AsyncIterator[list[dict]]:
+    """
+    asyncpg version of iter_pending_chunks, every chunk is one keyset query
+    """
+    lower, upper = shard_bounds(shard, num_shards)
+    await acheck_storage_profile(apg_conn)
+    while True:
+        query, params = pending_rows_query(after, lower, upper)
+        params["limit"] = chunk_size
+        # %(name)s placeholders to asyncpg positional ones
+        for i, name in enumerate(params, start=1):
+            query = query.replace(f"%({name})s", f"${i}")
+        rows = await apg_conn.fetch(query, *params.values())
+        if not rows:
+            return
+        after = rows[-1]["idx"]
+        yield [{"idx": row["idx"], "text": row["text"]} for row in rows]
+        if len(rows) < chunk_size:
+            return
+
+
+def backfill(
+    pg_conn,
+    write_chunk: Callable[[list[dict]], int],
+    chunk_size: int = CHUNK_SIZE,
+    shard: int = 0,
+    num_shards: int = 1,
+    checkpoint_path: str | None = None,
+    limit: int = -1,
+) -> int:
+    """
+    params:
+    pg_conn: psycopg2 connection used only for reading
+    write_chunk: Callable, embeds chunk of {"idx", "text"} rows, writes it back
+                 and returns number of rows written
+    checkpoint_path: str, file storing the last written idx, resumed from on start
+    limit: int, max number of chunks, limit < 0 means until no row is left
+
+    The checkpoint advances only past chunks with every row written, a short
+    write stops the backfill, so the next run starts again from that chunk.
+    It is cleared when no pending row is left, so it only resumes runs
+    stopped by an error or `limit`.
+
+    returns number of processed chunks
+    """
+    after = load_checkpoint(checkpoint_path)
+    cnt = 0
+    for chunk in iter_pending_chunks(pg_conn, chunk_size, shard, num_shards, after):
+        if cnt == limit:
+            break
+        written = write_chunk(chunk)
+        if written != len(chunk):
+            raise RuntimeError(
+                f"{written} of {len(chunk)} rows written after {after}, "
+                "checkpoint not advanced"
+            )
+        after = chunk[-1]["idx"]
+        save_checkpoint(checkpoint_path, after)
+        cnt += 1
+    else:
+        clear_checkpoint(checkpoint_path)
+    return cnt
+
+
+def parse_backfill_args(
+    default_checkpoint: str, parser: argparse.ArgumentParser | None = None
+) -> argparse.Namespace:
+    """
+    --shard/--num-shards/--checkpoint options shared by the update scripts,
+    added to script's own `parser`, the checkpoint file is per shard
+    """
+    parser = parser or argparse.ArgumentParser()
+    parser.add_argument("--shard", type=int, default=0)
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--checkpoint", default=default_checkpoint)
+    args = parser.parse_args()
+    if args.checkpoint:
+        args.checkpoint = f"{args.checkpoint}.{args.shard}-of-{args.num_shards}"
+    return args
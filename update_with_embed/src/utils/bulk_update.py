@@ -0,0 +1,218 @@
+import hashlib
+import io
+from itertools import islice
+from typing import Iterable
+
+from .storage_profile import (
+    StorageProfile,
+    column_type,
+    profile_name,
+    storage_profile,
+    truncate_embeds,
+    truncate_sql,
+)
+from .vector_codec import encode_idx_embed_copy
+
+EMBED_TABLE = "youtube_comments"
+STAGING_TABLE = "embed_staging"
+BATCH_SIZE = 1_000
+COMMIT_SIZE = 10_000
+# text_sha256 stores hash of the text an embedding was computed from, rows
+# whose text did not change since are not embedded again, see text_sha256()
+TEXT_HASH_SQL = "sha256(convert_to(text, 'UTF8'))"
+# column is part of data-import create_table, migrate_storage.py adds it
+# to older tables
+ADD_TEXT_HASH_SQL = (
+    f"ALTER TABLE {EMBED_TABLE} ADD COLUMN IF NOT EXISTS text_sha256 BYTEA"
+)
+
+
+def text_sha256(text: str) -> bytes:
+    """
+    same hash as TEXT_HASH_SQL computes in Postgres
+    """
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+EMBED_COLUMN_SQL = f"""
+    SELECT format_type(atttypid, atttypmod), atttypmod
+    FROM pg_attribute
+    WHERE attrelid = '{EMBED_TABLE}'::regclass AND attname = 'embed'
+"""
+
+
+def alter_embed_column_sql(current: str, current_dims: int, profile: StorageProfile):
+    """
+    returns statement changing embed column of type `current` to `profile`,
+    None when it already matches, and whether it clears stored embeddings.
+    Stored embeddings are truncated in place when the profile has no more
+    dimensions than the column, otherwise they are cleared and embedded again
+    by the next backfill.
+    """
+    if current == column_type(profile):
+        return None, False
+    clears = current_dims < profile["dims"]
+    using = "NULL" if clears else truncate_sql("embed", profile)
+    statement = f"""
+        ALTER TABLE {EMBED_TABLE}
+        ALTER COLUMN embed TYPE {column_type(profile)} USING {using}
+    """
+    return statement, clears
+
+
+def check_storage_profile(pg_conn, profile: StorageProfile | None = None):
+    """
+    raises when the embed column does not match `profile` (default EMBED_STORAGE
+    env), the column is changed only by migrate_storage.py
+    """
+    profile = profile or storage_profile()
+    with pg_conn.cursor() as cur:
+        cur.execute(EMBED_COLUMN_SQL)
+        current, _ = cur.fetchone()
+    _raise_on_mismatch(current, profile)
+
+
+async def acheck_storage_profile(apg_conn, profile: StorageProfile | None = None):
+    profile = profile or storage_profile()
+    current, _ = await apg_conn.fetchrow(EMBED_COLUMN_SQL)
+    _raise_on_mismatch(current, profile)
+
+
+def _raise_on_mismatch(current: str, profile: StorageProfile):
+    if current != column_type(profile):
+        raise ValueError(
+            f"embed column is {current}, storage profile {profile_name(profile)} "
+            f"needs {column_type(profile)}, run migrate_storage.py or set "
+            "EMBED_STORAGE to match the column"
+        )
+
+
+def staging_table(profile: StorageProfile) -> str:
+    return f"{STAGING_TABLE}_{profile_name(profile).replace('-', '_')}"
+
+
+def _batches(items: Iterable, batch_size: int):
+    items = iter(items)
+    while batch := list(islice(items, batch_size)):
+        yield batch
+
+
+def _truncate_batch(batch: list, profile: StorageProfile) -> list:
+    # no-op for embeds already truncated in the encode step
+    embeds = truncate_embeds([embed for _, embed, _ in batch], profile)
+    return [
+        (idx, embed, text_hash)
+        for (idx, _, text_hash), embed in zip(batch, embeds)
+    ]
+
+
+def bulk_update_embeddings(
+    pg_conn,
+    items: Iterable[tuple[str, list[float], bytes]],
+    batch_size: int = BATCH_SIZE,
+    commit_size: int = COMMIT_SIZE,
+    profile: StorageProfile | None = None,
+) -> int:
+    """
+    params:
+    pg_conn: psycopg2 connection
+    items: Iterable[tuple[str, list[float], bytes]], (idx, embed, text_sha256)
+        of the text the embed was computed from, see text_sha256()
+    batch_size: int, rows COPYed to staging table and applied by single UPDATE
+    commit_size: int, rows per transaction, ignored in autocommit mode
+    profile: StorageProfile, default EMBED_STORAGE env, embeds longer than
+        profile dims are truncated
+
+    Every batch is COPYed, with vectors in pgvector binary format, into
+    a temp staging table and applied by one set based UPDATE ... FROM
+    instead of an UPDATE per row. text_sha256 is written as staged, a text
+    changed since it was read keeps the row pending for the next backfill.
+
+    returns number of updated rows
+    """
+    profile = profile or storage_profile()
+    staging = staging_table(profile)
+    updated = 0
+    since_commit = 0
+    with pg_conn.cursor() as cur:
+        cur.execute(
+            f"""
+                CREATE TEMP TABLE IF NOT EXISTS {staging} (
+                    idx             UUID,
+                    embed           {column_type(profile)},
+                    text_sha256     BYTEA
+                )
+            """
+        )
+        for batch in _batches(items, batch_size):
+            batch = _truncate_batch(batch, profile)
+            buffer = io.BytesIO(encode_idx_embed_copy(batch, profile["dtype"]))
+            # in autocommit mode every statement commits on its own, rows left
+            # by a failed UPDATE must not be applied with this batch
+            cur.execute(f"TRUNCATE {staging}")
+            cur.copy_expert(
+                f"""
+                    COPY {staging} (idx, embed, text_sha256)
+                    FROM STDIN WITH (FORMAT binary)
+                """,
+                buffer,
+            )
+            cur.execute(
+                f"""
+                    UPDATE {EMBED_TABLE} t
+                    SET embed = s.embed, text_sha256 = s.text_sha256
+                    FROM {staging} s WHERE t.idx = s.idx
+                """
+            )
+            updated += cur.rowcount
+
+            since_commit += len(batch)
+            if since_commit >= commit_size and not pg_conn.autocommit:
+                pg_conn.commit()
+                since_commit = 0
+    if not pg_conn.autocommit:
+        pg_conn.commit()
+    return updated
+
+
+async def abulk_update_embeddings(
+    apg_conn,
+    items: Iterable[tuple[str, list[float], bytes]],
+    batch_size: int = BATCH_SIZE,
+    profile: StorageProfile | None = None,
+) -> int:
+    """
+    asyncpg version of bulk_update_embeddings, every batch runs in its
+    own transaction. Needs vector codec registered on the connection,
+    see vector_codec.register_vector_codec.
+    """
+    profile = profile or storage_profile()
+    staging = staging_table(profile)
+    updated = 0
+    await apg_conn.execute(
+        f"""
+            CREATE TEMP TABLE IF NOT EXISTS {staging} (
+                idx             UUID,
+                embed           {column_type(profile)},
+                text_sha256     BYTEA
+            )
+        """
+    )
+    for batch in _batches(items, batch_size):
+        batch = _truncate_batch(batch, profile)
+        async with apg_conn.transaction():
+            await apg_conn.execute(f"TRUNCATE {staging}")
+            await apg_conn.copy_records_to_table(
+                staging,
+                records=[(str(idx), embed, h) for idx, embed, h in batch],
+                columns=["idx", "embed", "text_sha256"],
+            )
+            status = await apg_conn.execute(
+                f"""
+                    UPDATE {EMBED_TABLE} t
+                    SET embed = s.embed, text_sha256 = s.text_sha256
+                    FROM {staging} s WHERE t.idx = s.idx
+                """
+            )
+            updated += int(status.split()[-1])
+    return updated
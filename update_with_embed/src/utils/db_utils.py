@@ -1,6 +1,11 @@
 from sqlalchemy import create_engine
+import asyncpg as apg
+import psycopg2 as pg2
 import os
 
+from .bulk_update import EMBED_TABLE
+from .vector_codec import register_vector_codec
+
 
 def open_sqlalchemy_conn():
     host = ("localhost",)
@@ -12,3 +17,41 @@ def open_sqlalchemy_conn():
         f"postgresql://{user[0]}:{password[0]}@{host[0]}:{port[0]}/{database[0]}"
     )
     return create_engine(connection_str)
+
+
+def open_pg_conn():
+    return pg2.connect(
+        host="localhost",
+        port=os.environ["PG_PORT"],
+        database="pgvector-test",
+        user=os.environ["PG_USER"],
+        password=os.environ["PG_PASSWORD"],
+    )
+
+
+def open_asyncpg_pool(size: int = 10):
+    """
+    asyncpg pool which sends `vector` values in binary format,
+    await it or use as `async with`
+    """
+    return apg.create_pool(
+        host="localhost",
+        port=os.environ["PG_PORT"],
+        database="pgvector-test",
+        user=os.environ["PG_USER"],
+        password=os.environ["PG_PASSWORD"],
+        min_size=size,
+        max_size=size,
+        init=register_vector_codec,
+    )
+
+
+def sample_texts(pg_conn, rows: int) -> list[str]:
+    """
+    returns random sample of comments, so lengths follow the real distribution
+    """
+    with pg_conn.cursor() as cur:
+        cur.execute(
+            f"SELECT text FROM {EMBED_TABLE} ORDER BY random() LIMIT %s", (rows,)
+        )
+        return [text or "" for (text,) in cur.fetchall()]
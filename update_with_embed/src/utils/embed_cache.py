@@ -0,0 +1,157 @@
+import hashlib
+import sqlite3
+import time
+import unicodedata
+from typing import Awaitable, Callable, Sequence
+
+import numpy as np
+
+CACHE_PATH = "/tmp/embed_cache.sqlite"
+MAX_CACHE_BYTES = 2 << 30
+# sqlite row overhead + 32 B key + last_used, on top of the embedding itself
+ENTRY_OVERHEAD_BYTES = 64
+
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFC", " ".join(str(text).split()))
+
+
+def text_key(text: str, model: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class EmbedCache:
+    """
+    Persistent embedding cache keyed by sha256 of model name and normalized
+    text, evicts least recently used entries above `max_bytes`. Backed by
+    sqlite in WAL mode, so the socket workers and the Ollama clients can
+    share one file. The sqlite connection is opened on first use and is not
+    pickled, so the cache can be passed to worker processes.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        path: str = CACHE_PATH,
+        max_bytes: int = MAX_CACHE_BYTES,
+        dim: int = 768,
+    ):
+        self.model = model
+        self.path = path
+        self.max_entries = max_bytes // (4 * dim + ENTRY_OVERHEAD_BYTES)
+        self._conn = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                    CREATE TABLE IF NOT EXISTS embeds (
+                        key         BLOB PRIMARY KEY,
+                        embed       BLOB NOT NULL,
+                        last_used   REAL NOT NULL
+                    )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeds_last_used ON embeds (last_used)"
+            )
+        return self._conn
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, np.ndarray]:
+        found = {}
+        now = time.time()
+        # stay below sqlite's host parameter limit
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            placeholders = ", ".join(["?"] * len(batch))
+            rows = self.conn.execute(
+                f"SELECT key, embed FROM embeds WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            found.update(
+                (key, np.frombuffer(embed, dtype="<f4")) for key, embed in rows
+            )
+            self.conn.execute(
+                f"UPDATE embeds SET last_used = ? WHERE key IN ({placeholders})",
+                [now, *batch],
+            )
+        return found
+
+    def put_many(self, items: dict[bytes, np.ndarray]):
+        if not items:
+            return
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeds (key, embed, last_used) VALUES (?, ?, ?)",
+            [
+                (key, np.asarray(embed, dtype="<f4").tobytes(), now)
+                for key, embed in items.items()
+            ],
+        )
+        (count,) = self.conn.execute("SELECT count(*) FROM embeds").fetchone()
+        if count > self.max_entries:
+            # evict a tenth more than needed so eviction does not run every put
+            self.conn.execute(
+                """
+                    DELETE FROM embeds WHERE key IN (
+                        SELECT key FROM embeds ORDER BY last_used LIMIT ?
+                    )
+                """,
+                (count - self.max_entries + self.max_entries // 10,),
+            )
+
+
+def _plan(texts: list[str], cache: EmbedCache | None, model: str):
+    if cache is not None:
+        model = cache.model
+    keys = [text_key(text, model) for text in texts]
+    # duplicates within the batch are embedded once, by their first occurrence
+    unique = {}
+    for key, text in zip(keys, texts):
+        unique.setdefault(key, text)
+    found = cache.get_many(list(unique)) if cache is not None else {}
+    missing = [key for key in unique if key not in found]
+    return keys, unique, found, missing
+
+
+def embed_with_cache(
+    texts: list[str],
+    embed_texts: Callable[[list[str]], Sequence],
+    cache: EmbedCache | None = None,
+    model: str = "",
+) -> list[np.ndarray]:
+    """
+    Embeds only texts which are neither cached nor repeated in the batch,
+    returns embeddings in the order of `texts`
+    """
+    keys, unique, found, missing = _plan(texts, cache, model)
+    if missing:
+        embeds = embed_texts([unique[key] for key in missing])
+        computed = dict(zip(missing, embeds))
+        if cache is not None:
+            cache.put_many(computed)
+        found.update(computed)
+    return [found[key] for key in keys]
+
+
+async def aembed_with_cache(
+    texts: list[str],
+    embed_texts: Callable[[list[str]], Awaitable[Sequence]],
+    cache: EmbedCache | None = None,
+    model: str = "",
+) -> list[np.ndarray]:
+    keys, unique, found, missing = _plan(texts, cache, model)
+    if missing:
+        embeds = await embed_texts([unique[key] for key in missing])
+        computed = dict(zip(missing, embeds))
+        if cache is not None:
+            cache.put_many(computed)
+        found.update(computed)
+    return [found[key] for key in keys]
@@ -0,0 +1,61 @@
+import json
+import socket
+import struct
+
+# every frame is a 4 byte big endian payload length followed by the payload
+FRAME_HEADER = struct.Struct("!I")
+
+
+def send_frame(sock: socket.socket, payload: bytes):
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def send_json_frame(sock: socket.socket, message):
+    send_frame(sock, json.dumps(message).encode("utf-8"))
+
+
+class FrameReader:
+    """
+    Receives frames from `sock` into one reusable buffer, which grows only
+    when a frame larger than any before arrives
+    """
+
+    def __init__(self, sock: socket.socket, initial_size: int = 1 << 16):
+        self._sock = sock
+        self._buffer = bytearray(initial_size)
+
+    def _recv_exactly(self, size: int) -> memoryview | None:
+        if size > len(self._buffer):
+            self._buffer = bytearray(size)
+        view = memoryview(self._buffer)[:size]
+        received = 0
+        while received < size:
+            n = self._sock.recv_into(view[received:], size - received)
+            if n == 0:
+                if received == 0:
+                    return None
+                raise ConnectionError(f"connection closed after {received}/{size} B")
+            received += n
+        return view
+
+    def read_frame(self) -> memoryview | None:
+        """
+        returns view of the payload, valid until next read_frame call,
+        None when the peer closed the connection between frames
+        """
+        header = self._recv_exactly(FRAME_HEADER.size)
+        if header is None:
+            return None
+        (size,) = FRAME_HEADER.unpack(header)
+        if size == 0:
+            return memoryview(b"")
+        payload = self._recv_exactly(size)
+        if payload is None:
+            raise ConnectionError("connection closed before frame payload")
+        return payload
+
+    def read_json_frame(self):
+        payload = self.read_frame()
+        if payload is None:
+            return None
+        return json.loads(bytes(payload))
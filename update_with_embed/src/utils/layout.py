@@ -0,0 +1,113 @@
+import os
+import queue
+import time
+
+from .local_encoder import encode_bucketed, get_model, pin_to_cpus
+
+POLL_S = 5.0
+
+
+def available_cpus() -> list[int]:
+    return sorted(os.sched_getaffinity(0))
+
+
+def parse_layout(value: str) -> tuple[int, int]:
+    """
+    "4x2" -> 4 worker processes x 2 threads each
+    """
+    num_workers, _, threads = value.lower().partition("x")
+    return int(num_workers), int(threads)
+
+
+def cpu_sets(num_workers: int, threads: int) -> list[list[int]]:
+    """
+    returns disjoint cpu set of `threads` cpus for every worker
+    """
+    cpus = available_cpus()
+    if num_workers * threads > len(cpus):
+        raise ValueError(
+            f"layout {num_workers}x{threads} needs {num_workers * threads} cpus, "
+            f"{len(cpus)} available"
+        )
+    return [cpus[i * threads : (i + 1) * threads] for i in range(num_workers)]
+
+
+def candidate_layouts() -> list[tuple[int, int]]:
+    """
+    all layouts using every available cpu, from 1 x all to all x 1
+    """
+    num_cpus = len(available_cpus())
+    return [(n, num_cpus // n) for n in range(1, num_cpus + 1) if num_cpus % n == 0]
+
+
+def bench_layout_worker(cpus: list[int], texts: list[str], barrier, results):
+    pin_to_cpus(cpus)
+    model = get_model(threads=len(cpus))
+    # warm up thread pools and allocator before the timed run
+    encode_bucketed(model, texts[:64])
+    barrier.wait()
+    start = time.perf_counter()
+    encode_bucketed(model, texts)
+    results.put(time.perf_counter() - start)
+
+
+def bench_layout(mp_context, num_workers: int, threads: int, texts: list[str]) -> float:
+    """
+    Every worker encodes `texts` at the same time on its own cpu set
+
+    returns embeddings/s of all workers together
+    """
+    barrier = mp_context.Barrier(num_workers)
+    results = mp_context.Queue()
+    processes = [
+        mp_context.Process(
+            target=bench_layout_worker, args=[cpus, texts, barrier, results]
+        )
+        for cpus in cpu_sets(num_workers, threads)
+    ]
+    for p in processes:
+        p.start()
+    try:
+        seconds = max(wait_result(results, processes) for _ in processes)
+    except Exception:
+        for p in processes:
+            p.terminate()
+        raise
+    finally:
+        for p in processes:
+            p.join()
+    return num_workers * len(texts) / seconds
+
+
+def wait_result(results, processes) -> float:
+    # a worker which crashed, e.g. out of memory loading the model, never
+    # puts its result and leaves the others waiting at the barrier
+    while True:
+        try:
+            return results.get(timeout=POLL_S)
+        except queue.Empty:
+            for p in processes:
+                if p.exitcode not in (None, 0):
+                    raise RuntimeError(f"{p.name} exited with {p.exitcode}")
+
+
+def autotune_layout(mp_context, texts: list[str]) -> tuple[int, int]:
+    """
+    returns (workers, threads) layout of highest embeddings/s on `texts`
+    """
+    results = {}
+    for num_workers, threads in candidate_layouts():
+        try:
+            results[(num_workers, threads)] = bench_layout(
+                mp_context, num_workers, threads, texts
+            )
+        except RuntimeError as e:
+            print(f"layout {num_workers}x{threads} failed: {e}")
+            continue
+        print(
+            f"layout {num_workers}x{threads}: "
+            f"{results[(num_workers, threads)]:.1f} embeddings/s"
+        )
+    if not results:
+        raise RuntimeError("every layout failed")
+    return max(results, key=results.get)
@@ -0,0 +1,198 @@
+import os
+
+import numpy as np
+
+MODEL_PATH = "/home/stephenx/LLMs/ollama/third-party/safetensors/nomic-embed-text-v1.5"
+MAX_SEQ_LENGTH = 512
+MAX_BATCH_SIZE = 64
+# padded tokens per forward pass, batch of short texts holds more rows
+BATCH_TOKENS = 8_192
+
+ONNX_MODEL_PATH = f"{MODEL_PATH}-onnx"
+# ONNX graph shipped in the model repo, relative to MODEL_PATH
+ONNX_FILE = "onnx/model.onnx"
+# dynamic int8 quantization target, "avx2" on CPUs without avx512 vnni
+QUANT_CONFIG = "avx512_vnni"
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+_models = {}
+
+
+def embed_backend() -> str:
+    """
+    EMBED_BACKEND env, read alike by the forkserver preload and the workers
+    """
+    backend = os.environ.get("EMBED_BACKEND", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend}, expected one of {BACKENDS}")
+    return backend
+
+
+def model_name(backend: str) -> str:
+    """
+    name used as embedding cache key, int8 embeddings differ from torch ones
+    """
+    name = os.path.basename(MODEL_PATH)
+    return name if backend == "torch" else f"{name}:{backend}"
+
+
+def pin_to_cpus(cpus: list[int]):
+    """
+    Restricts this process to `cpus` and sizes its intra-op thread pools to
+    match, so workers on disjoint cpu sets do not oversubscribe cores
+    """
+    os.sched_setaffinity(0, cpus)
+    # read by OpenMP runtimes initialized after this point
+    os.environ["OMP_NUM_THREADS"] = str(len(cpus))
+    import torch
+
+    torch.set_num_threads(len(cpus))
+
+
+def load_model(backend: str, threads: int | None = None):
+    # torch is imported here, not at module import
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(
+            MODEL_PATH,
+            # device="cpu",
+            trust_remote_code=True,
+        )
+    model_kwargs = {}
+    if threads is not None:
+        # ONNX Runtime sizes its thread pool when the session is created
+        import onnxruntime as ort
+
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = threads
+        model_kwargs["session_options"] = session_options
+    if backend == "onnx-int8":
+        model_kwargs["file_name"] = f"onnx/model_qint8_{QUANT_CONFIG}.onnx"
+    return SentenceTransformer(
+        ONNX_MODEL_PATH,
+        backend="onnx",
+        trust_remote_code=True,
+        model_kwargs=model_kwargs,
+    )
+
+
+def get_model(backend: str | None = None, threads: int | None = None):
+    """
+    SentenceTransformer of `backend` (default EMBED_BACKEND env), loaded on
+    first use, importing this module is cheap. Loaded in the forkserver before
+    fork (see embed_model_preload), the weights are shared copy-on-write by all
+    workers. Every backend exposes the same encode and tokenizer.
+
+    threads: int, ONNX Runtime intra-op threads, used only when loading
+    """
+    backend = backend or embed_backend()
+    if backend not in _models:
+        _models[backend] = load_model(backend, threads)
+    return _models[backend]
+
+
+def export_onnx(quant_config: str = QUANT_CONFIG):
+    """
+    Offline step, copies the model with its ONNX graph to ONNX_MODEL_PATH as
+    onnx/model.onnx and adds its dynamically int8 quantized copy
+    onnx/model_qint8_{quant_config}.onnx
+
+    nomic-embed-text-v1.5 is a trust_remote_code nomic_bert model, which
+    optimum has no ONNX export config for, so the graph is not exported from
+    torch but taken from onnx/model.onnx shipped in the model's HF repo
+    """
+    from sentence_transformers import (
+        SentenceTransformer,
+        export_dynamic_quantized_onnx_model,
+    )
+
+    if not os.path.exists(os.path.join(MODEL_PATH, ONNX_FILE)):
+        raise FileNotFoundError(
+            f"{MODEL_PATH}/{ONNX_FILE} missing, download it from the "
+            "nomic-ai/nomic-embed-text-v1.5 repo, optimum cannot export nomic_bert"
+        )
+    model = SentenceTransformer(
+        MODEL_PATH,
+        backend="onnx",
+        trust_remote_code=True,
+        model_kwargs={"file_name": ONNX_FILE},
+    )
+    model.save(ONNX_MODEL_PATH)
+    export_dynamic_quantized_onnx_model(model, quant_config, ONNX_MODEL_PATH)
+
+
+def token_lengths(model, texts: list[str]) -> list[int]:
+    """
+    returns number of tokens of every text, truncated to model.max_seq_length
+    """
+    encoded = model.tokenizer(
+        texts,
+        truncation=True,
+        max_length=model.max_seq_length,
+        add_special_tokens=True,
+    )
+    return [len(ids) for ids in encoded["input_ids"]]
+
+
+def length_buckets(
+    lengths: list[int],
+    max_batch_size: int = MAX_BATCH_SIZE,
+    batch_tokens: int = BATCH_TOKENS,
+) -> list[list[int]]:
+    """
+    Groups indices of texts of similar length, every bucket is one forward pass,
+    so a text is padded only to the longest text of its bucket
+
+    returns buckets of indices into `lengths`
+    """
+    buckets = []
+    bucket = []
+    # ascending order, so the last index of a bucket is its longest text
+    for i in np.argsort(lengths, kind="stable"):
+        if bucket and (
+            len(bucket) == max_batch_size
+            or (len(bucket) + 1) * lengths[i] > batch_tokens
+        ):
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(int(i))
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
+def padding_efficiency(lengths: list[int], buckets: list[list[int]]) -> float:
+    """
+    returns real tokens / padded tokens over all buckets
+    """
+    padded = sum(len(bucket) * max(lengths[i] for i in bucket) for bucket in buckets)
+    return sum(lengths) / padded if padded else 1.0
+
+
+def encode_bucketed(
+    model,
+    texts: list[str],
+    max_batch_size: int = MAX_BATCH_SIZE,
+    batch_tokens: int = BATCH_TOKENS,
+) -> np.ndarray:
+    """
+    Encodes `texts` by SentenceTransformer `model` in buckets of similar token
+    length, texts longer than model.max_seq_length are truncated
+
+    returns embeddings in order of `texts`
+    """
+    if not texts:
+        return np.empty((0, model.get_sentence_embedding_dimension()), np.float32)
+    buckets = length_buckets(token_lengths(model, texts), max_batch_size, batch_tokens)
+    embeds = None
+    for bucket in buckets:
+        bucket_embeds = model.encode(
+            [texts[i] for i in bucket],
+            batch_size=len(bucket),
+            convert_to_numpy=True,
+        )
+        if embeds is None:
+            embeds = np.empty((len(texts), bucket_embeds.shape[1]), bucket_embeds.dtype)
+        embeds[bucket] = bucket_embeds
+    return embeds
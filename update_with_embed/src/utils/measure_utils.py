@@ -1,4 +1,6 @@
+from contextlib import contextmanager
 from functools import wraps
+import resource
 import time
 
 
@@ -24,3 +26,52 @@ def measure(func):
         return result
 
     return measure_wrapper
+
+
+class StageStats:
+    """
+    Busy time of a pipeline stage, utilization close to 1 marks the bottleneck,
+    the other stages spend the rest waiting on their queues
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.busy = 0.0
+        self.items = 0
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def busy_with(self, items: int = 1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy += time.perf_counter() - start
+            self.items += items
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        utilization = self.busy / elapsed if elapsed else 0.0
+        return (
+            f"{self.name}: {self.items} items, busy {self.busy:.2f}/{elapsed:.2f} s, "
+            f"utilization {100 * utilization:.0f}%"
+        )
+
+
+def memory_usage_mb() -> dict[str, float]:
+    """
+    returns current rss and pss of this process, pss splits shared pages among
+    the processes sharing them, so copy-on-write model weights count once.
+    Outside linux only peak rss is known.
+    """
+    try:
+        usage = {}
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    usage[f"{key.lower()}_mb"] = int(value.split()[0]) / 1024
+        return usage
+    except OSError:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"peak_rss_mb": peak_rss / 1024}
@@ -0,0 +1,167 @@
+import asyncio as aio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+
+import numpy as np
+from ollama import AsyncClient
+
+from .embed_cache import EmbedCache, aembed_with_cache
+from .measure_utils import async_measure
+from .storage_profile import StorageProfile, storage_profile, truncate_embeds
+
+OLLAMA_HOSTS = "http://localhost:11434"
+OLLAMA_MODEL = "nomic-embed-text"
+# embed cache key, /api/embed returns normalized embeddings unlike the older
+# /api/embeddings, so entries of the two endpoints must not mix
+OLLAMA_CACHE_MODEL = f"{OLLAMA_MODEL}@/api/embed"
+EMBED_BATCH_SIZE = 64
+MAX_RETRIES = 4
+BACKOFF_S = 0.5
+MAX_BACKOFF_S = 10.0
+
+
+def ollama_hosts() -> list[str]:
+    """
+    OLLAMA_HOSTS env, comma separated, e.g. "http://gpu-1:11434,http://gpu-2:11434"
+    """
+    return [
+        host.strip()
+        for host in os.environ.get("OLLAMA_HOSTS", OLLAMA_HOSTS).split(",")
+        if host.strip()
+    ]
+
+
+class AIMDLimiter:
+    """
+    Bounds in-flight requests by adaptive limit: grows by one after a full
+    window of fast successes, halves on error or when request latency exceeds
+    `target_latency_s`
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 2,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        target_latency_s: float = 2.0,
+    ):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency_s = target_latency_s
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = aio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, latency_s: float, ok: bool):
+        async with self._cond:
+            self.in_flight -= 1
+            if not ok or latency_s > self.target_latency_s:
+                self.limit = max(self.min_limit, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self._successes = 0
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            await self.release(time.perf_counter() - start, ok)
+
+
+class OllamaPool:
+    """
+    Embeds texts by batched /api/embed requests spread over `hosts`, each host
+    has its own AIMD limiter, so slower hosts get fewer requests in flight.
+    Failed batches are retried on the next host with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        hosts: list[str] | None = None,
+        model: str = OLLAMA_MODEL,
+        batch_size: int = EMBED_BATCH_SIZE,
+        cache: EmbedCache | None = None,
+        max_retries: int = MAX_RETRIES,
+        limiter_options: dict | None = None,
+        profile: StorageProfile | None = None,
+    ):
+        self.hosts = hosts or ollama_hosts()
+        self.model = model
+        self.batch_size = batch_size
+        self.cache = cache
+        self.max_retries = max_retries
+        self.clients = [AsyncClient(host=host) for host in self.hosts]
+        self.limiters = [AIMDLimiter(**(limiter_options or {})) for _ in self.hosts]
+        self._next_host = 0
+        self.profile = profile or storage_profile()
+
+    @async_measure
+    async def embed_bulk(self, bulk: list[dict]) -> np.ndarray:
+        """
+        returns embeddings in order of bulk, truncated to the storage profile,
+        cached and repeated texts are not sent to Ollama
+        """
+        embeds = await aembed_with_cache(
+            [item.get("text", "") for item in bulk],
+            self.embed_texts,
+            self.cache,
+            model=f"{self.model}@/api/embed",
+        )
+        return truncate_embeds(embeds, self.profile)
+
+    async def embed_texts(self, texts: list[str]) -> list[list[float]]:
+        batches = await aio.gather(
+            *[
+                self._embed_batch(texts[i : i + self.batch_size])
+                for i in range(0, len(texts), self.batch_size)
+            ]
+        )
+        return [embed for batch in batches for embed in batch]
+
+    def _pick_host(self) -> int:
+        # round robin start, then the host with most free slots
+        start = self._next_host
+        self._next_host = (start + 1) % len(self.hosts)
+        order = [(start + i) % len(self.hosts) for i in range(len(self.hosts))]
+        return max(
+            order,
+            key=lambda i: self.limiters[i].limit - self.limiters[i].in_flight,
+        )
+
+    async def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        for attempt in range(self.max_retries + 1):
+            host = self._pick_host()
+            try:
+                async with self.limiters[host].slot():
+                    response = await self.clients[host].embed(
+                        model=self.model, input=texts
+                    )
+                    if len(response.embeddings) != len(texts):
+                        raise ValueError(
+                            f"{len(response.embeddings)} embeddings "
+                            f"for {len(texts)} texts"
+                        )
+                return response.embeddings
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                backoff = min(MAX_BACKOFF_S, BACKOFF_S * 2**attempt)
+                print(f"{self.hosts[host]}: {e!r}, retry {attempt + 1} in {backoff}s")
+                await aio.sleep(backoff * random.uniform(0.5, 1.0))
@@ -0,0 +1,189 @@
+import json
+import time
+
+import numpy as np
+
+from .bulk_update import EMBED_TABLE
+from .storage_profile import COLUMN_TYPES, StorageProfile, column_type, storage_profile
+
+INDEX_METHODS = ("hnsw", "ivfflat")
+# metric: (distance operator, operator class suffix)
+METRICS = {
+    "cosine": ("<=>", "cosine_ops"),
+    "l2": ("<->", "l2_ops"),
+    "ip": ("<#>", "ip_ops"),
+}
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+IVFFLAT_LISTS = 100
+
+
+def index_name(method: str, table: str = EMBED_TABLE) -> str:
+    # same name as data-import load_profile.build_indexes
+    return f"{table}_embed_{method}_index"
+
+
+def vector_indexes(cur, table: str = EMBED_TABLE) -> list[str]:
+    """
+    returns names of every hnsw and ivfflat index of `table`
+    """
+    cur.execute(
+        """
+            SELECT i.relname FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_am am ON am.oid = i.relam
+            WHERE x.indrelid = %s::regclass AND am.amname = ANY(%s)
+        """,
+        (table, list(INDEX_METHODS)),
+    )
+    return [name for (name,) in cur.fetchall()]
+
+
+def drop_vector_indexes(cur, table: str = EMBED_TABLE):
+    """
+    drops every hnsw and ivfflat index of `table`
+    """
+    for name in vector_indexes(cur, table):
+        cur.execute(f"DROP INDEX {name}")
+
+
+def build_index(
+    cur,
+    method: str,
+    table: str = EMBED_TABLE,
+    profile: StorageProfile | None = None,
+    metric: str = "cosine",
+    m: int = HNSW_M,
+    ef_construction: int = HNSW_EF_CONSTRUCTION,
+    lists: int = IVFFLAT_LISTS,
+    maintenance_work_mem: str | None = None,
+) -> dict:
+    """
+    params:
+    method: str, hnsw or ivfflat, replaces index of the same name,
+            other indexes of table are kept
+    m, ef_construction: int, hnsw graph degree and build candidate list size
+    lists: int, ivfflat clusters, about rows / 1000 up to 1M rows
+
+    returns build time and index size
+    """
+    if method not in INDEX_METHODS:
+        raise ValueError(f"method must be one of {INDEX_METHODS}, got {method}")
+    profile = profile or storage_profile()
+    opclass = f"{COLUMN_TYPES[profile['dtype']]}_{METRICS[metric][1]}"
+    if method == "hnsw":
+        options = f"m = {m}, ef_construction = {ef_construction}"
+    else:
+        options = f"lists = {lists}"
+
+    cur.execute(f"DROP INDEX IF EXISTS {index_name(method, table)}")
+    if maintenance_work_mem:
+        cur.execute("SET maintenance_work_mem = %s", (maintenance_work_mem,))
+    start = time.perf_counter()
+    cur.execute(
+        f"""
+            CREATE INDEX {index_name(method, table)} ON {table}
+            USING {method} (embed {opclass}) WITH ({options})
+        """
+    )
+    build_s = time.perf_counter() - start
+    cur.execute("SELECT pg_relation_size(%s)", (index_name(method, table),))
+    return {"build_s": build_s, "index_mb": cur.fetchone()[0] / 2**20}
+
+
+def set_search_params(
+    cur, ef_search: int | None = None, probes: int | None = None, exact=False
+):
+    """
+    ef_search: int, hnsw candidate list size, at least k
+    probes: int, ivfflat lists scanned
+    exact: bool, no index scan, sequential scan of every row
+    """
+    if ef_search is not None:
+        cur.execute("SET hnsw.ef_search = %s", (ef_search,))
+    if probes is not None:
+        cur.execute("SET ivfflat.probes = %s", (probes,))
+    cur.execute(f"SET enable_indexscan = {'off' if exact else 'on'}")
+
+
+def search(
+    cur,
+    query,
+    k: int = 10,
+    table: str = EMBED_TABLE,
+    profile: StorageProfile | None = None,
+    metric: str = "cosine",
+) -> list[tuple[str, float]]:
+    """
+    returns top k (idx, distance) nearest to `query` embedding, with search
+    parameters of set_search_params
+    """
+    profile = profile or storage_profile()
+    operator = METRICS[metric][0]
+    cur.execute(
+        f"""
+            SELECT idx::text, embed {operator} %(query)s::{column_type(profile)}
+            FROM {table}
+            ORDER BY embed {operator} %(query)s::{column_type(profile)}
+            LIMIT %(k)s
+        """,
+        {"query": str(np.asarray(query).tolist()), "k": k},
+    )
+    return cur.fetchall()
+
+
+def sample_query_rows(
+    cur, num_queries: int, table: str = EMBED_TABLE
+) -> list[tuple[str, np.ndarray]]:
+    """
+    returns (idx, embed) of random embedded rows, used as queries
+    """
+    cur.execute(
+        f"""
+            SELECT idx::text, embed::vector::text FROM {table}
+            WHERE embed IS NOT NULL ORDER BY random() LIMIT %s
+        """,
+        (num_queries,),
+    )
+    return [
+        (idx, np.array(json.loads(embed), np.float32))
+        for idx, embed in cur.fetchall()
+    ]
+
+
+def run_queries(
+    cur,
+    queries: list[tuple[str, np.ndarray]],
+    k: int,
+    table: str = EMBED_TABLE,
+    profile: StorageProfile | None = None,
+    metric: str = "cosine",
+) -> tuple[list[list[str]], list[float]]:
+    """
+    returns top k idx and latency of every query, queries are held out of
+    `table`, a filter removing the query row would be applied after the ANN
+    scan and cut its ef_search candidates short
+    """
+    results, latencies = [], []
+    for idx, query in queries:
+        start = time.perf_counter()
+        found = search(cur, query, k, table, profile, metric)
+        latencies.append(time.perf_counter() - start)
+        results.append([found_idx for found_idx, _ in found])
+    return results, latencies
+
+
+def recall_at_k(results: list[list[str]], truth: list[list[str]]) -> float:
+    hits = sum(len(set(r) & set(t)) for r, t in zip(results, truth))
+    total = sum(len(t) for t in truth)
+    return hits / total if total else 1.0
+
+
+def latency_stats(latencies: list[float]) -> dict:
+    if not latencies:
+        return {"qps": None, "p50_ms": None, "p99_ms": None}
+    return {
+        "qps": len(latencies) / sum(latencies),
+        "p50_ms": 1000 * float(np.percentile(latencies, 50)),
+        "p99_ms": 1000 * float(np.percentile(latencies, 99)),
+    }
@@ -0,0 +1,69 @@
+import os
+from typing import TypedDict
+
+import numpy as np
+
+# nomic-embed-text-v1.5 is trained with Matryoshka loss at these sizes
+MATRYOSHKA_DIMS = (768, 512, 256, 128, 64)
+COLUMN_TYPES = {"float32": "vector", "float16": "halfvec"}
+DEFAULT_STORAGE = "768-float32"
+
+
+class StorageProfile(TypedDict):
+    dims: int
+    dtype: str
+
+
+def parse_storage_profile(value: str) -> StorageProfile:
+    """
+    "256-float16" -> 256 first dimensions stored as halfvec(256)
+    """
+    dims, _, dtype = value.partition("-")
+    profile = StorageProfile(dims=int(dims), dtype=dtype or "float32")
+    if profile["dims"] not in MATRYOSHKA_DIMS:
+        raise ValueError(f"dims must be one of {MATRYOSHKA_DIMS}, got {dims}")
+    if profile["dtype"] not in COLUMN_TYPES:
+        raise ValueError(f"dtype must be one of {tuple(COLUMN_TYPES)}, got {dtype}")
+    return profile
+
+
+def storage_profile() -> StorageProfile:
+    """
+    EMBED_STORAGE env, e.g. "768-float32" (default) or "256-float16"
+    """
+    return parse_storage_profile(os.environ.get("EMBED_STORAGE", DEFAULT_STORAGE))
+
+
+def profile_name(profile: StorageProfile) -> str:
+    return f"{profile['dims']}-{profile['dtype']}"
+
+
+def column_type(profile: StorageProfile) -> str:
+    return f"{COLUMN_TYPES[profile['dtype']]}({profile['dims']})"
+
+
+def cosine_opclass(profile: StorageProfile) -> str:
+    return f"{COLUMN_TYPES[profile['dtype']]}_cosine_ops"
+
+
+def truncate_embeds(embeds, profile: StorageProfile) -> np.ndarray:
+    """
+    Keeps first profile["dims"] dimensions and normalizes them back to unit
+    length, as Matryoshka embeddings are meant to be truncated
+    """
+    embeds = np.asarray(embeds, dtype=np.float32)
+    if embeds.ndim != 2 or embeds.shape[1] == profile["dims"]:
+        return embeds
+    truncated = embeds[:, : profile["dims"]]
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    return truncated / np.where(norms == 0, 1, norms)
+
+
+def truncate_sql(column: str, profile: StorageProfile) -> str:
+    """
+    SQL expression truncating stored full size `column` to `profile`
+    """
+    return (
+        f"l2_normalize(subvector({column}::vector, 1, {profile['dims']}))"
+        f"::{column_type(profile)}"
+    )
@@ -0,0 +1,87 @@
+import struct
+import uuid
+
+import numpy as np
+
+# pgvector binary send/recv: int16 dim, int16 unused, dim x big endian float4,
+# halfvec has the same layout with big endian float2 values
+VECTOR_HEADER = struct.Struct("!hh")
+# PGCOPY wire format: signature, flags field, header extension length,
+# kept byte for byte equal to data-import/src/copy_utils.py, which encodes
+# the import side, the two source trees cannot import each other
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+
+
+def encode_vector(embed) -> bytes:
+    """
+    embed: np.ndarray or list of floats, float32 arrays are only byte swapped,
+    same encoding as data-import/src/copy_utils.encode_vector
+    """
+    values = np.asarray(embed, dtype=">f4")
+    return VECTOR_HEADER.pack(len(values), 0) + values.tobytes()
+
+
+def decode_vector(data: bytes) -> np.ndarray:
+    dim, _ = VECTOR_HEADER.unpack_from(data)
+    return np.frombuffer(data, dtype=">f4", count=dim, offset=VECTOR_HEADER.size)
+
+
+def encode_halfvec(embed) -> bytes:
+    values = np.asarray(embed, dtype=">f2")
+    return VECTOR_HEADER.pack(len(values), 0) + values.tobytes()
+
+
+def decode_halfvec(data: bytes) -> np.ndarray:
+    dim, _ = VECTOR_HEADER.unpack_from(data)
+    return np.frombuffer(
+        data, dtype=">f2", count=dim, offset=VECTOR_HEADER.size
+    ).astype(np.float32)
+
+
+ENCODERS = {"float32": encode_vector, "float16": encode_halfvec}
+
+
+async def register_vector_codec(apg_conn):
+    """
+    asyncpg sends and receives `vector` and `halfvec` in binary format,
+    usable as pool init
+    """
+    await apg_conn.set_type_codec(
+        "vector",
+        schema="public",
+        encoder=encode_vector,
+        decoder=decode_vector,
+        format="binary",
+    )
+    # halfvec exists since pgvector 0.7.0
+    if await apg_conn.fetchval("SELECT to_regtype('halfvec') IS NOT NULL"):
+        await apg_conn.set_type_codec(
+            "halfvec",
+            schema="public",
+            encoder=encode_halfvec,
+            decoder=decode_halfvec,
+            format="binary",
+        )
+
+
+def encode_idx_embed_copy(items: list[tuple], dtype: str = "float32") -> bytes:
+    """
+    returns COPY ... (FORMAT binary) payload of (idx uuid, embed vector) rows,
+    or (idx uuid, embed vector, text_sha256 bytea) rows, dtype "float16"
+    encodes embed as halfvec
+    """
+    encode = ENCODERS[dtype]
+    buffer = bytearray(PGCOPY_HEADER)
+    for idx, embed, *rest in items:
+        vector = encode(embed)
+        buffer += struct.pack("!hi", 2 + len(rest), 16)
+        buffer += uuid.UUID(str(idx)).bytes
+        buffer += struct.pack("!i", len(vector))
+        buffer += vector
+        for value in rest:
+            # bytea binary recv is the raw bytes
+            buffer += struct.pack("!i", len(value))
+            buffer += value
+    buffer += PGCOPY_TRAILER
+    return bytes(buffer)